@@ -5,12 +5,114 @@ Adds a new topic to the appropriate Snowflake sink connector configuration.
 """
 
 import argparse
+import bisect
+import functools
+import mmap
+import os
+import shutil
 import sys
-import yaml
+import tempfile
 import re
 from pathlib import Path
 from difflib import unified_diff
 
+# Unchanged lines shown around each hunk (unified_diff's default)
+DIFF_CONTEXT_LINES = 3
+
+# ANSI colors for diff lines, by first character; file headers are bold
+DIFF_COLORS = {'+': '\033[32m', '-': '\033[31m', '@': '\033[36m'}  # Green, red, cyan
+DIFF_HEADER_COLOR = '\033[1m'
+
+_HUNK_HEADER = re.compile(r'^@@ -(\d+)(,\d+)? \+(\d+)(,\d+)? @@')
+
+
+@functools.lru_cache(maxsize=8)
+def _connector_key(connector_name):
+    """The connector's YAML key as bytes, built once per connector."""
+    return f'{connector_name}:'.encode()
+
+
+def _is_dedented(content, pos):
+    """True if the line at `pos` starts a new YAML key (indent < 8) or we're at EOF."""
+    if pos == len(content):
+        return True
+    
+    head = content[pos:pos + 8]
+    indent = len(head) - len(head.lstrip(b' \t'))
+    return indent < 8 and pos + indent < len(content) and not content[pos + indent:pos + indent + 1].isspace()
+
+
+def _block_after(content, pos, require_dedent=True):
+    """Indented `>-` block following a key that ends at `pos`.
+    
+    Returns (start, end, lines) or None if the text after the key isn't a
+    folded block (followed by a dedented line, if `require_dedent`).
+    """
+    n = len(content)
+    
+    # Optional whitespace, then `>-` (or `>`)
+    while pos < n and content[pos:pos + 1].isspace():
+        pos += 1
+    if content[pos:pos + 1] != b'>':
+        return None
+    pos += 1
+    if content[pos:pos + 1] == b'-':
+        pos += 1
+    
+    # The block starts after the last newline of the trailing whitespace;
+    # earlier newlines are only tried if that fails
+    ws_end = pos
+    while ws_end < n and content[ws_end:ws_end + 1].isspace():
+        ws_end += 1
+    starts = []
+    newline = content.find(b'\n', pos, ws_end)
+    while newline != -1:
+        starts.append(newline + 1)
+        newline = content.find(b'\n', newline + 1, ws_end)
+    
+    for start in reversed(starts):
+        # Gather lines indented at least 8 columns
+        end = start
+        lines = []
+        while True:
+            newline = content.find(b'\n', end)
+            if newline == -1:
+                break
+            line = content[end:newline]
+            if len(line) < 9 or line[:8].strip(b' \t'):
+                break
+            lines.append(line)
+            end = newline + 1
+        
+        if lines and (not require_dedent or _is_dedented(content, end)):
+            return start, end, lines
+    
+    return None
+
+
+def _find_block(content, connector_name, key, pos=0, require_dedent=True):
+    """Locate the indented lines under `key` (bytes) in a connector's config.
+    
+    The connector is searched for from `pos`. Returns (connector_pos,
+    start, end, entries): the block is content[start:end] and entries are
+    its values with whitespace and trailing commas stripped.
+    """
+    head = _connector_key(connector_name)
+    pos = content.find(head, pos)
+    if pos == -1:
+        return None
+    
+    key_pos = content.find(key, pos + len(head))
+    while key_pos != -1:
+        block = _block_after(content, key_pos + len(key), require_dedent)
+        if block:
+            start, end, lines = block
+            entries = [line.strip().rstrip(b',') for line in lines if line.strip()]
+            return pos, start, end, entries
+        key_pos = content.find(key, key_pos + 1)
+    
+    return None
+
 
 def get_connector_name(value_type, sink_type):
     """Get the appropriate connector name based on sink type and value type."""
@@ -32,114 +134,143 @@ def generate_table_name(topic):
     return table_name
 
 
+def existing_topics(file_content, connector_name):
+    """Topics listed under the connector's topics: key (empty if there is none)."""
+    block = _find_block(file_content, connector_name, b'topics:', require_dedent=False)
+    return block[3] if block else []
+
+
 def check_topic_exists(file_content, connector_name, topic):
     """Check if topic already exists in the connector configuration."""
-    # Find the topics section for this connector
-    pattern = rf'{re.escape(connector_name)}:.*?topics:\s*>-?\s*\n((?:[ \t]{{8,}}[^\n]+\n)+)'
-    match = re.search(pattern, file_content, re.DOTALL)
-    
-    if not match:
-        return False
-    
-    topics_section = match.group(1)
-    topic_list = [t.strip().rstrip(',') for t in topics_section.strip().split('\n') if t.strip()]
-    
-    return topic in topic_list
+    return topic.encode() in existing_topics(file_content, connector_name)
 
 
 def add_topic_to_file(file_content, connector_name, topic, sink_type):
-    """Add topic by modifying the file content directly (preserving formatting)."""
+    """Add topic by modifying the file content directly (preserving formatting).
     
-    # Pattern: Match topics: >- through all indented lines until next YAML key
-    pattern = rf'({re.escape(connector_name)}:.*?topics:\s*>-?\s*\n)((?:[ \t]{{8,}}[^\n]+\n)+)(?=[ \t]{{0,7}}\S|\Z)'
+    file_content is the raw file (bytes or an mmap). Returns (new_content,
+    start, old_end, new_end): everything before `start` and after
+    `old_end`/`new_end` is identical in the old and new content.
+    """
     
-    match = re.search(pattern, file_content, re.DOTALL)
+    # Locate topics: >- and all indented lines until next YAML key
+    block = _find_block(file_content, connector_name, b'topics:')
     
-    if not match:
+    if not block:
         print(f"❌ Error: Could not find topics section for {connector_name}")
         sys.exit(1)
     
-    prefix = match.group(1)
-    topics_section = match.group(2)
-    
-    # Parse existing topics (preserving exact order)
-    topic_lines = topics_section.strip().split('\n')
-    topic_list = []
-    for line in topic_lines:
-        if line.strip():
-            topic_list.append(line.strip().rstrip(','))
-    
-    # Find alphabetical insertion position WITHOUT changing existing order
-    insert_index = len(topic_list)  # Default: append at end
-    for i, existing_topic in enumerate(topic_list):
-        if topic < existing_topic:
-            insert_index = i
-            break
+    connector_pos, block_start, block_end, topic_list = block
     
-    # Insert new topic at the correct position
-    topic_list.insert(insert_index, topic)
+    # Insert alphabetically WITHOUT changing existing order: before the first
+    # topic that sorts after it. The list isn't guaranteed to be sorted, so
+    # only bisect when it is
+    topic_bytes = topic.encode()
+    if all(a <= b for a, b in zip(topic_list, topic_list[1:])):
+        insert_index = bisect.bisect_right(topic_list, topic_bytes)
+    else:
+        insert_index = next((i for i, t in enumerate(topic_list) if topic_bytes < t), len(topic_list))
+    topic_list.insert(insert_index, topic_bytes)
     
     # Format topics with proper indentation (8 spaces) - preserving order
-    formatted_topics = '        ' + ',\n        '.join(topic_list)
-    
-    # Replace in content
-    new_content, replacements = re.subn(
-        pattern,
-        lambda m: f"{m.group(1)}{formatted_topics}\n",
-        file_content,
-        flags=re.DOTALL
-    )
+    formatted_topics = b'        ' + b',\n        '.join(topic_list)
     
-    if replacements == 0:
-        print("❌ Error: Could not update topics section")
-        sys.exit(1)
+    # Splice into content
+    new_content = file_content[:block_start] + formatted_topics + b'\n' + file_content[block_end:]
+    
+    # Track the edited span as a shared prefix/suffix length; both stay valid
+    # across successive edits
+    start = block_start
+    tail = len(file_content) - block_end
     
     # For Snowflake realtime connectors, also update snowflake.topic2table.map
     if sink_type == 'realtime':
         table_name = generate_table_name(topic)
         new_mapping = f"{topic}:{table_name}"
         
-        # Pattern for topic2table.map
-        map_pattern = rf'({re.escape(connector_name)}:.*?snowflake\.topic2table\.map:\s*>-?\s*\n)((?:[ \t]{{8,}}[^\n]+\n)+)(?=[ \t]{{0,7}}\S|\Z)'
-        map_match = re.search(map_pattern, new_content, re.DOTALL)
+        # Nothing before the topics block changed, so resume at the connector
+        map_block = _find_block(new_content, connector_name, b'snowflake.topic2table.map:', connector_pos)
         
-        if map_match:
-            # Parse existing mappings (preserving exact order)
-            mappings_section = map_match.group(2)
-            mapping_lines = mappings_section.strip().split('\n')
-            mapping_list = []
-            for line in mapping_lines:
-                if line.strip():
-                    mapping_list.append(line.strip().rstrip(','))
+        if map_block:
+            _, map_start, map_end, mapping_list = map_block
             
             # Check if mapping already exists
-            if not any(m.startswith(f"{topic}:") for m in mapping_list):
-                # Find alphabetical insertion position WITHOUT changing existing order
-                map_insert_index = len(mapping_list)  # Default: append at end
-                for i, existing_mapping in enumerate(mapping_list):
-                    existing_topic = existing_mapping.split(':')[0]
-                    if topic < existing_topic:
-                        map_insert_index = i
-                        break
-                
-                # Insert new mapping at the correct position
-                mapping_list.insert(map_insert_index, new_mapping)
+            if not any(m.startswith(f"{topic}:".encode()) for m in mapping_list):
+                # Insert alphabetically by topic WITHOUT changing existing order
+                # (bisecting only when the mappings are sorted, as for topics)
+                map_topics = [m.split(b':', 1)[0] for m in mapping_list]
+                if all(a <= b for a, b in zip(map_topics, map_topics[1:])):
+                    map_insert_index = bisect.bisect_right(map_topics, topic_bytes)
+                else:
+                    map_insert_index = next(
+                        (i for i, t in enumerate(map_topics) if topic_bytes < t), len(map_topics)
+                    )
+                mapping_list.insert(map_insert_index, new_mapping.encode())
                 
                 # Format mappings with proper indentation (preserving order)
-                formatted_mappings = '        ' + ',\n        '.join(mapping_list)
+                formatted_mappings = b'        ' + b',\n        '.join(mapping_list)
                 
-                # Replace in content
-                new_content, map_replacements = re.subn(
-                    map_pattern,
-                    lambda m: f"{m.group(1)}{formatted_mappings}\n",
-                    new_content,
-                    flags=re.DOTALL
-                )
+                # Splice into content
+                start = min(start, map_start)
+                tail = min(tail, len(new_content) - map_end)
+                new_content = new_content[:map_start] + formatted_mappings + b'\n' + new_content[map_end:]
                 
-                if map_replacements > 0:
-                    print(f"   ✅ Added topic2table mapping: {new_mapping}")
+                print(f"   ✅ Added topic2table mapping: {new_mapping}")
     
-    return new_content
+    return new_content, start, len(file_content) - tail, len(new_content) - tail
+
+
+def _diff_window(old, new, start, old_end, new_end, context=DIFF_CONTEXT_LINES):
+    """Line-aligned slices of old/new around the edited span, with the slice's starting line.
+    
+    old/new are bytes; only the returned window is decoded.
+    """
+    win_start = old.rfind(b'\n', 0, start) + 1
+    for _ in range(context):
+        if win_start == 0:
+            break
+        win_start = old.rfind(b'\n', 0, win_start - 1) + 1
+    
+    # Finish the partially edited line (if any), then take `context` more
+    win_end = old_end
+    extra = context if win_end == 0 or old[win_end - 1:win_end] == b'\n' else context + 1
+    for _ in range(extra):
+        newline = old.find(b'\n', win_end)
+        if newline == -1:
+            win_end = len(old)
+            break
+        win_end = newline + 1
+    
+    # The tail after old_end/new_end is identical, so it ends at the same line in new
+    new_win_end = new_end + (win_end - old_end)
+    # Count lines the way splitlines() does (it also breaks on a lone \r)
+    first_line = len(old[:win_start].splitlines())
+    
+    return (
+        old[win_start:win_end].decode('utf-8', errors='replace'),
+        new[win_start:new_win_end].decode('utf-8', errors='replace'),
+        first_line,
+    )
+
+
+def _shift_hunk_header(line, offset):
+    """Shift a unified diff @@ header by `offset` lines."""
+    m = _HUNK_HEADER.match(line)
+    if not m:
+        return line
+    
+    old_start = int(m.group(1)) + offset
+    new_start = int(m.group(3)) + offset
+    return f"@@ -{old_start}{m.group(2) or ''} +{new_start}{m.group(4) or ''} @@{line[m.end():]}"
+
+
+def _use_color(stream):
+    """ANSI colors for terminals only; NO_COLOR / FORCE_COLOR override."""
+    if os.environ.get('NO_COLOR'):
+        return False
+    if os.environ.get('FORCE_COLOR'):
+        return True
+    return stream.isatty()
 
 
 def preview_changes(connector_name, topic, existing_count, sink_type):
@@ -161,89 +292,56 @@ def preview_changes(connector_name, topic, existing_count, sink_type):
     print("-" * 70)
 
 
-def main():
-    parser = argparse.ArgumentParser(
-        description='Add Kafka topic to helm-apps values.yaml'
-    )
-    parser.add_argument(
-        '--topic',
-        required=True,
-        help='Kafka topic name (e.g., customer.action.v1)'
-    )
-    parser.add_argument(
-        '--file',
-        required=True,
-        help='Path to values.yaml file'
-    )
-    parser.add_argument(
-        '--value-type',
-        choices=['json', 'protobuf'],
-        default='json',
-        help='Value type (default: json)'
-    )
-    parser.add_argument(
-        '--sink-type',
-        choices=['realtime', 's3'],
-        default='realtime',
-        help='Sink type (default: realtime)'
-    )
-    parser.add_argument(
-        '--dry-run',
-        action='store_true',
-        help='Show what would be changed without modifying the file'
-    )
-    
-    args = parser.parse_args()
-    
-    # Validate file exists
-    values_file = Path(args.file)
-    if not values_file.exists():
-        print(f"❌ Error: File not found: {args.file}")
+def run(topic, file, value_type='json', sink_type='realtime', dry_run=False):
+    """Add topic to the connector in the values.yaml at `file` (same as the CLI)."""
+    # Open once; a missing file surfaces here instead of via a separate stat
+    values_file = Path(file)
+    try:
+        f = open(values_file, 'rb')
+    except FileNotFoundError:
+        print(f"❌ Error: File not found: {file}")
         sys.exit(1)
     
-    print(f"📂 Reading: {args.file}")
+    print(f"📂 Reading: {file}")
     
-    # Read file content
-    with open(values_file, 'r') as f:
-        file_content = f.read()
+    # Map the file instead of reading/decoding it; edits are spliced as bytes
+    with f:
+        if os.fstat(f.fileno()).st_size:
+            file_content = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            file_content = b''
     
     # Get connector name
-    connector_name = get_connector_name(args.value_type, args.sink_type)
+    connector_name = get_connector_name(value_type, sink_type)
     print(f"🔍 Looking for connector: {connector_name}")
     
     # Check if connector exists in file
-    if connector_name not in file_content:
+    if file_content.find(connector_name.encode()) == -1:
         print(f"❌ Error: Connector '{connector_name}' not found in values.yaml")
         sys.exit(1)
     
     print(f"✅ Found connector: {connector_name}")
     
     # Check if topic already exists
-    if check_topic_exists(file_content, connector_name, args.topic):
-        print(f"\n⚠️  Topic '{args.topic}' already exists in {connector_name}")
+    if check_topic_exists(file_content, connector_name, topic):
+        print(f"\n⚠️  Topic '{topic}' already exists in {connector_name}")
         print("ℹ️  No changes needed")
         sys.exit(0)
     
     # Count existing topics
-    pattern = rf'{re.escape(connector_name)}:.*?topics:\s*>-?\s*\n((?:[ \t]{{8,}}[^\n]+\n)+)'
-    match = re.search(pattern, file_content, re.DOTALL)
-    
-    if match:
-        topics_section = match.group(1)
-        topic_list = [t.strip().rstrip(',') for t in topics_section.strip().split('\n') if t.strip()]
-        existing_count = len(topic_list)
-    else:
-        existing_count = 0
+    existing_count = len(existing_topics(file_content, connector_name))
     
     print(f"📊 Found {existing_count} existing topics")
     
     # Preview the changes
-    preview_changes(connector_name, args.topic, existing_count, args.sink_type)
+    preview_changes(connector_name, topic, existing_count, sink_type)
     
     # Generate the new content to show diff
     print(f"\n💾 Generating changes (preserving original formatting)...")
     try:
-        new_content = add_topic_to_file(file_content, connector_name, args.topic, args.sink_type)
+        new_content, start, old_end, new_end = add_topic_to_file(
+            file_content, connector_name, topic, sink_type
+        )
     except Exception as e:
         print(f"❌ Error generating changes: {e}")
         sys.exit(1)
@@ -253,37 +351,39 @@ def main():
     print("📝 EXACT FILE CHANGES (unified diff)")
     print("="*70)
     
-    original_lines = file_content.splitlines(keepends=True)
-    new_lines = new_content.splitlines(keepends=True)
+    # Only diff the edited window; line numbers are shifted back afterwards
+    old_window, new_window, first_line = _diff_window(
+        file_content, new_content, start, old_end, new_end
+    )
+    original_lines = old_window.splitlines(keepends=True)
+    new_lines = new_window.splitlines(keepends=True)
     
     diff = unified_diff(
         original_lines,
         new_lines,
-        fromfile=f'{args.file} (original)',
-        tofile=f'{args.file} (modified)',
+        fromfile=f'{file} (original)',
+        tofile=f'{file} (modified)',
         lineterm=''
     )
     
     diff_lines = list(diff)
     if diff_lines:
+        color = _use_color(sys.stdout)
+        parts = []
         for line in diff_lines:
+            if line.startswith('@@'):
+                line = _shift_hunk_header(line, first_line)
+            
             # Color code the diff output
-            if line.startswith('+++') or line.startswith('---'):
-                print(f"\033[1m{line}\033[0m")  # Bold
-            elif line.startswith('+'):
-                print(f"\033[32m{line}\033[0m")  # Green
-            elif line.startswith('-'):
-                print(f"\033[31m{line}\033[0m")  # Red
-            elif line.startswith('@@'):
-                print(f"\033[36m{line}\033[0m")  # Cyan
-            else:
-                print(line)
+            code = DIFF_HEADER_COLOR if line.startswith(('+++', '---')) else DIFF_COLORS.get(line[:1])
+            parts.append(f"{code}{line}\033[0m\n" if color and code else f"{line}\n")
+        sys.stdout.write(''.join(parts))
     else:
         print("(No changes detected)")
     
     print("="*70)
     
-    if args.dry_run:
+    if dry_run:
         print("\n🔍 DRY RUN MODE - No changes written to file")
         print("✅ Run without --dry-run to apply changes")
         sys.exit(0)
@@ -291,8 +391,16 @@ def main():
     # Write the changes
     print(f"\n💾 Writing changes to file...")
     try:
-        with open(values_file, 'w') as f:
-            f.write(new_content)
+        # Write a sibling temp file and swap it in, so values.yaml is never half-written
+        fd, tmp_path = tempfile.mkstemp(dir=values_file.parent, prefix=f'.{values_file.name}.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(new_content)
+            shutil.copymode(values_file, tmp_path)
+            os.replace(tmp_path, values_file)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
         
         print("✅ Successfully updated values.yaml")
         print("ℹ️  Only the topics section was modified, all other formatting preserved")
@@ -301,5 +409,42 @@ def main():
         sys.exit(1)
 
 
+def main():
+    parser = argparse.ArgumentParser(
+        description='Add Kafka topic to helm-apps values.yaml'
+    )
+    parser.add_argument(
+        '--topic',
+        required=True,
+        help='Kafka topic name (e.g., customer.action.v1)'
+    )
+    parser.add_argument(
+        '--file',
+        required=True,
+        help='Path to values.yaml file'
+    )
+    parser.add_argument(
+        '--value-type',
+        choices=['json', 'protobuf'],
+        default='json',
+        help='Value type (default: json)'
+    )
+    parser.add_argument(
+        '--sink-type',
+        choices=['realtime', 's3'],
+        default='realtime',
+        help='Sink type (default: realtime)'
+    )
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='Show what would be changed without modifying the file'
+    )
+    
+    args = parser.parse_args()
+    
+    run(args.topic, args.file, args.value_type, args.sink_type, args.dry_run)
+
+
 if __name__ == '__main__':
     main()
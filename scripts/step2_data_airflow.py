@@ -4,231 +4,459 @@ Step 2: Add StreamTaskConfig to data-airflow DAG
 Adds a new stream configuration for loading Kafka topic data to Snowflake.
 """
 
-import argparse
+import bisect
+import functools
+import mmap
+import os
+import shutil
 import sys
+import tempfile
 import re
 from pathlib import Path
-from difflib import unified_diff
 
+# Unchanged lines shown around each hunk (unified_diff's default)
+DIFF_CONTEXT_LINES = 3
 
+# DAG files larger than this are memory-mapped instead of read into memory
+MMAP_MIN_SIZE = 64 * 1024
+
+# ANSI colors for diff lines, by first character; file headers are bold
+DIFF_COLORS = {'+': '\033[32m', '-': '\033[31m', '@': '\033[36m'}  # Green, red, cyan
+DIFF_HEADER_COLOR = '\033[1m'
+
+# Opening of the configs = [ ... ] list holding the StreamTaskConfig entries.
+# The DAG file is handled as bytes, so these are bytes patterns
+_CONFIGS_START_RE = re.compile(rb'configs\s*=\s*\[')
+_TABLE_RE = re.compile(rb'table="([^"]+)"')
+_TABLE_LINE_RE = re.compile(rb'table="([^"\n]+)"')  # Same, within a single line
+_HUNK_HEADER = re.compile(r'^@@ -(\d+)(,\d+)? \+(\d+)(,\d+)? @@')
+
+# Topic -> table name characters, applied in one str.translate pass
+_TABLE_NAME_TRANS = str.maketrans({'.': '__', '-': '_'})
+
+
+def _find_configs_span(content):
+    """Offsets (start, end) of the body of the configs = [ ... ] list in `content` (bytes), or None.
+    
+    The body runs from just after the `[` to the newline before the matching
+    `]` (the `]` itself if it shares a line with the last entry). Brackets in
+    string literals and comments are skipped.
+    """
+    pos = content.find(b'configs')
+    while pos != -1:
+        start_match = _CONFIGS_START_RE.match(content, pos)
+        if start_match:
+            break
+        pos = content.find(b'configs', pos + 1)
+    else:
+        return None
+    
+    start = i = start_match.end()
+    n = len(content)
+    depth = 1
+    while i < n:
+        c = content[i:i + 1]
+        if c == b'[':
+            depth += 1
+        elif c == b']':
+            depth -= 1
+            if depth == 0:
+                break
+        elif c == b'"' or c == b"'":
+            # Jump to the closing quote, skipping escaped ones
+            i = content.find(c, i + 1)
+            while i > 0 and content[i - 1:i] == b'\\':
+                i = content.find(c, i + 1)
+            if i == -1:
+                return None
+        elif c == b'#':
+            i = content.find(b'\n', i)
+            if i == -1:
+                return None
+        i += 1
+    else:
+        return None
+    
+    # Leave the whitespace run before the `]`, from its first newline, to the suffix
+    end = i
+    while end > start and content[end - 1:end].isspace():
+        end -= 1
+    newline = content.find(b'\n', end, i)
+    return start, (i if newline == -1 else newline)
+
+
+@functools.lru_cache(maxsize=4096)
 def generate_table_name(topic):
     """Convert topic name to Snowflake table name."""
     # customer.action.v1 -> customer__action__v1__raw
-    table_name = topic.replace('.', '__').replace('-', '_') + '__raw'
+    table_name = topic.translate(_TABLE_NAME_TRANS) + '__raw'
     return table_name
 
 
-def check_config_exists(content, table_name):
-    """Check if the stream config already exists."""
-    pattern = f'table="{table_name}"'
-    return pattern in content
+def add_stream_config_to_file(content, table_name):
+    """Add StreamTaskConfig by modifying the file content directly (preserving formatting).
+    
+    content is the raw file (bytes or an mmap) and table_name a str. Returns
+    (new_content, existing_count, already_exists, start, old_end, new_end):
+    `already_exists` lists the requested tables that are in the
+    configs list already (those are left alone), and everything before
+    `start` and after `old_end`/`new_end` is identical in the old and new
+    content.
+    """
+    return add_many_stream_configs(content, [table_name])
 
 
-def add_stream_config_to_file(content, table_name):
-    """Add StreamTaskConfig by modifying the file content directly (preserving formatting)."""
+def add_many_stream_configs(content, table_names):
+    """Add a StreamTaskConfig for each of `table_names` in one pass over the configs list.
+    
+    Gives the same result as adding them one at a time with
+    add_stream_config_to_file, and returns the same tuple; the edited span
+    covers all of the new entries.
+    """
     
     # Find the configs = [ ... ] section with StreamTaskConfig entries
-    pattern = r'(configs\s*=\s*\[)(.*?)(\n\s*\])'
-    match = re.search(pattern, content, re.DOTALL)
+    span = _find_configs_span(content)
     
-    if not match:
+    if not span:
         print("❌ Error: Could not find 'configs = [...]' section in DAG file")
         sys.exit(1)
     
-    prefix = match.group(1)
-    configs_content = match.group(2)
-    suffix = match.group(3)
-    
-    # Parse existing StreamTaskConfig entries to extract table names
-    table_pattern = r'table="([^"]+)"'
-    existing_tables = re.findall(table_pattern, configs_content)
-    
-    # Find where to insert (alphabetically by table name)
-    lines = configs_content.split('\n')
-    insert_line_index = None
-    
-    for i, line in enumerate(lines):
-        table_match = re.search(table_pattern, line)
-        if table_match:
-            existing_table = table_match.group(1)
-            if table_name < existing_table:
-                # Find the start of this StreamTaskConfig block
-                for j in range(i, -1, -1):
-                    if 'StreamTaskConfig(' in lines[j]:
-                        insert_line_index = j
-                        # Don't move back - we want to insert right at this position
-                        # The blank line (if any) will be handled separately
-                        break
-                break
+    base, configs_end = span
+    configs_content = content[base:configs_end]
     
-    # Detect indentation from existing entries
-    indent = '        '  # Default 8 spaces
-    for line in lines:
-        if 'StreamTaskConfig(' in line:
-            indent_match = re.match(r'^(\s+)', line)
-            if indent_match:
-                indent = indent_match.group(1)
-            break
+    # Parse existing StreamTaskConfig entries to extract table names, and
+    # skip the requested tables that already have one
+    existing_tables = _TABLE_RE.findall(configs_content) if b'table="' in configs_content else []
+    existing_set = set(existing_tables)
+    requested = {t: t.encode() for t in table_names}
+    already_exists = [t for t, name in requested.items() if name in existing_set]
+    
+    # Collect the table= entries in one pass (first entry per line)
+    entries = []
+    for table_match in _TABLE_LINE_RE.finditer(configs_content):
+        if entries and configs_content.find(b'\n', entries[-1].start(), table_match.start()) == -1:
+            continue
+        entries.append(table_match)
+    entry_tables = [m.group(1) for m in entries]
+    # The DAG's entries aren't guaranteed to be sorted; bisect only when they are
+    tables_sorted = all(a <= b for a, b in zip(entry_tables, entry_tables[1:]))
+    
+    # Detect indentation from the first existing entry
+    indent = b'        '  # Default 8 spaces
+    first_block = configs_content.find(b'StreamTaskConfig(')
+    if first_block != -1:
+        head = configs_content[configs_content.rfind(b'\n', 0, first_block) + 1:first_block]
+        leading = head[:len(head) - len(head.lstrip())]
+        if leading:
+            indent = leading
     
-    # Create new StreamTaskConfig entry as separate lines
-    new_entry_lines = [
-        f'{indent}StreamTaskConfig(',
-        f'{indent}    table="{table_name}",',
-        f'{indent}    warehouse="LOADER_PRODUCTION_STREAMING",',
-        f'{indent}),'
-    ]
-    
-    # Insert the new entry
-    if insert_line_index is not None:
-        # Check if there's a blank line right before the insertion point
-        has_blank_before = (insert_line_index > 0 and 
-                           lines[insert_line_index - 1].strip() == '')
+    # Group the new entries by where they go (alphabetically by table name):
+    # the offset of the line before the first entry that sorts after them, or
+    # None to add them at the end. Sorting first keeps each group in order.
+    groups = {}
+    for table_name in sorted(set(requested.values()) - existing_set):
+        insert_pos = None
+        if tables_sorted:
+            idx = bisect.bisect_right(entry_tables, table_name)
+        else:
+            idx = next((i for i, t in enumerate(entry_tables) if table_name < t), len(entry_tables))
         
-        # If there's a blank line before, remove it first to avoid double spacing
-        if has_blank_before:
-            lines.pop(insert_line_index - 1)
-            insert_line_index -= 1
+        if idx < len(entries):
+            # Find the start of this StreamTaskConfig block (on this line or above)
+            line_end = configs_content.find(b'\n', entries[idx].end())
+            block_pos = configs_content.rfind(
+                b'StreamTaskConfig(', 0, len(configs_content) if line_end == -1 else line_end
+            )
+            if block_pos != -1:
+                # Don't move back - we want to insert right at this position
+                # The blank line (if any) will be handled separately
+                insert_pos = configs_content.rfind(b'\n', 0, block_pos) + 1
         
-        # Insert our new entry
-        for idx, entry_line in enumerate(new_entry_lines):
-            lines.insert(insert_line_index + idx, entry_line)
-    else:
-        # Add to the end (before the closing ])
-        for i in range(len(lines) - 1, -1, -1):
-            if lines[i].strip().endswith('),'):
-                # Remove ALL blank lines after this last entry
-                while (i + 1 < len(lines) and lines[i + 1].strip() == ''):
-                    lines.pop(i + 1)
-                
-                # Insert after the last entry (at position i+1)
-                for idx, entry_line in enumerate(new_entry_lines):
-                    lines.insert(i + 1 + idx, entry_line)
+        # Create new StreamTaskConfig entry
+        groups.setdefault(insert_pos, []).append(
+            b'%sStreamTaskConfig(\n'
+            b'%s    table="%s",\n'
+            b'%s    warehouse="LOADER_PRODUCTION_STREAMING",\n'
+            b'%s),' % (indent, indent, table_name, indent, indent)
+        )
+    
+    # Each splice replaces configs_content[splice_start:splice_end] with its
+    # new entries (a group is dropped if no place to insert it is found)
+    splices = []
+    for insert_pos, new_entries in groups.items():
+        if insert_pos is not None:
+            # If there's a blank line right before the insertion point, replace
+            # it too to avoid double spacing
+            splice_start = insert_pos
+            if insert_pos > 0:
+                prev_start = configs_content.rfind(b'\n', 0, insert_pos - 1) + 1
+                if configs_content[prev_start:insert_pos - 1].strip() == b'':
+                    splice_start = prev_start
+            splices.append((splice_start, insert_pos, b''.join(e + b'\n' for e in new_entries)))
+            continue
+        
+        if content[configs_end:configs_end + 1] == b']':
+            # The `]` shares a line with the last entry: split that line right
+            # after the entry's closing `)` and put the `]` on its own line
+            body_end = len(configs_content.rstrip())
+            if configs_content[:body_end].endswith(b'),'):
+                separator = b''
+            elif configs_content[:body_end].endswith(b')'):
+                separator = b','
+            else:
+                print("❌ Error: Could not find the end of the last entry in 'configs = [...]'")
+                sys.exit(1)
+            line_start = content.rfind(b'\n', 0, base) + 1
+            line = content[line_start:base]
+            closing = b'\n' + line[:len(line) - len(line.lstrip())]
+            splices.append((
+                body_end, len(configs_content),
+                separator + b''.join(b'\n' + e for e in new_entries) + closing
+            ))
+            continue
+        
+        # Add to the end (before the closing ]), after the last line ending in '),'
+        search_end = len(configs_content)
+        while True:
+            close_pos = configs_content.rfind(b'),', 0, search_end)
+            if close_pos == -1:
                 break
+            line_end = configs_content.find(b'\n', close_pos)
+            if line_end == -1:
+                line_end = len(configs_content)
+            if configs_content[close_pos + 2:line_end].strip() != b'':
+                search_end = configs_content.rfind(b'\n', 0, close_pos) + 1
+                continue
+            
+            # Remove ALL blank lines after this last entry
+            scan = line_end
+            while scan < len(configs_content):
+                next_end = configs_content.find(b'\n', scan + 1)
+                if next_end == -1:
+                    next_end = len(configs_content)
+                if configs_content[scan + 1:next_end].strip() != b'':
+                    break
+                scan = next_end
+            
+            # Insert after the last entry
+            splices.append((line_end, scan, b''.join(b'\n' + e for e in new_entries)))
+            break
+    
+    if not splices:
+        end = base + len(configs_content)
+        return content, len(existing_tables), already_exists, end, end, end
     
-    # Reconstruct the content
-    new_configs_content = '\n'.join(lines)
-    new_content = content[:match.start()] + prefix + new_configs_content + suffix + content[match.end():]
+    # Build the new content in one join
+    splices.sort()
+    pieces = [content[:base]]
+    pos = 0
+    for splice_start, splice_end, replacement in splices:
+        pieces.append(configs_content[pos:splice_start])
+        pieces.append(replacement)
+        pos = splice_end
+    pieces.append(content[base + pos:])
+    new_content = b''.join(pieces)
     
-    return new_content, len(existing_tables)
+    old_end = base + pos
+    return (
+        new_content, len(existing_tables), already_exists, base + splices[0][0], old_end,
+        len(new_content) - (len(content) - old_end),
+    )
+
+
+def _diff_window(old, new, start, old_end, new_end, context=DIFF_CONTEXT_LINES):
+    """Lines of old/new around the edited span (keepends), with the window's starting line.
+    
+    old/new are bytes; only the window is decoded. The unchanged lines before
+    and after the edit are split once and shared by both lists.
+    """
+    head_end = old.rfind(b'\n', 0, start) + 1
+    win_start = head_end
+    for _ in range(context):
+        if win_start == 0:
+            break
+        win_start = old.rfind(b'\n', 0, win_start - 1) + 1
+    
+    # Finish the partially edited line (if any), then take `context` more
+    tail_start = old_end
+    if tail_start and old[tail_start - 1:tail_start] != b'\n':
+        newline = old.find(b'\n', tail_start)
+        tail_start = len(old) if newline == -1 else newline + 1
+    win_end = tail_start
+    for _ in range(context):
+        newline = old.find(b'\n', win_end)
+        if newline == -1:
+            win_end = len(old)
+            break
+        win_end = newline + 1
+    
+    # The tail after old_end/new_end is identical, so it starts at the same line
+    # in new - unless new's edit doesn't end a line and runs on into it
+    new_tail_start = new_end + (tail_start - old_end)
+    if new_tail_start and new[new_tail_start - 1:new_tail_start] != b'\n':
+        newline = old.find(b'\n', tail_start, win_end)
+        tail_start = win_end if newline == -1 else newline + 1
+        new_tail_start = new_end + (tail_start - old_end)
+    # Count lines the way splitlines() does (it also breaks on a lone \r)
+    first_line = len(old[:win_start].splitlines())
+    
+    head = _decoded_lines(old[win_start:head_end])
+    tail = _decoded_lines(old[tail_start:win_end])
+    return (
+        head + _decoded_lines(old[head_end:tail_start]) + tail,
+        head + _decoded_lines(new[head_end:new_tail_start]) + tail,
+        first_line,
+    )
+
+
+def _decoded_lines(chunk):
+    """Lines of a bytes chunk (keepends), decoded for display."""
+    return chunk.decode('utf-8', errors='replace').splitlines(keepends=True)
+
+
+def _shift_hunk_header(line, offset):
+    """Shift a unified diff @@ header by `offset` lines."""
+    m = _HUNK_HEADER.match(line)
+    if not m:
+        return line
+    
+    old_start = int(m.group(1)) + offset
+    new_start = int(m.group(3)) + offset
+    return f"@@ -{old_start}{m.group(2) or ''} +{new_start}{m.group(4) or ''} @@{line[m.end():]}"
+
 
+def _use_color(stream):
+    """ANSI colors for terminals only; NO_COLOR / FORCE_COLOR override."""
+    if os.environ.get('NO_COLOR'):
+        return False
+    if os.environ.get('FORCE_COLOR'):
+        return True
+    return stream.isatty()
 
-def preview_changes(table_name, existing_count):
+
+def preview_changes(table_names, existing_count):
     """Print a preview of what changes will be made."""
     print("\n" + "="*70)
     print("📋 PREVIEW OF CHANGES")
     print("="*70)
     print(f"\n📊 Existing StreamTaskConfig entries: {existing_count}")
-    print(f"📊 After change: {existing_count + 1}")
+    print(f"📊 After change: {existing_count + len(table_names)}")
     print(f"\n➕ Adding new StreamTaskConfig:")
     print("-" * 70)
-    print(f"    StreamTaskConfig(")
-    print(f"        table=\"{table_name}\",")
-    print(f"        warehouse=\"LOADER_PRODUCTION_STREAMING\",")
-    print(f"    ),")
+    for table_name in table_names:
+        print(f"    StreamTaskConfig(")
+        print(f"        table=\"{table_name}\",")
+        print(f"        warehouse=\"LOADER_PRODUCTION_STREAMING\",")
+        print(f"    ),")
     print("-" * 70)
 
 
-def main():
-    parser = argparse.ArgumentParser(
-        description='Add StreamTaskConfig to data-airflow DAG'
-    )
-    parser.add_argument(
-        '--topic',
-        required=True,
-        help='Kafka topic name (e.g., customer.action.v1)'
-    )
-    parser.add_argument(
-        '--dag-file',
-        required=True,
-        help='Path to the DAG Python file'
-    )
-    parser.add_argument(
-        '--dry-run',
-        action='store_true',
-        help='Show what would be changed without modifying the file'
-    )
+def run(topic, dag_file, dry_run=False):
+    """Add a StreamTaskConfig for topic to the DAG at `dag_file` (same as the CLI)."""
+    run_many([topic], dag_file, dry_run)
+
+
+def run_many(topics, dag_file, dry_run=False):
+    """Add StreamTaskConfigs for all of `topics`, reading and writing the DAG once."""
+    # Open once; a missing file surfaces here instead of via a separate stat
+    dag_path = Path(dag_file)
+    try:
+        f = open(dag_path, 'rb')
+    except FileNotFoundError:
+        print(f"❌ Error: File not found: {dag_file}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"❌ Error reading file: {e}")
+        sys.exit(1)
     
-    args = parser.parse_args()
+    print(f"📂 Reading: {dag_file}")
     
-    # Validate file exists
-    dag_file = Path(args.dag_file)
-    if not dag_file.exists():
-        print(f"❌ Error: File not found: {args.dag_file}")
-        sys.exit(1)
+    # Map large files instead of copying them into memory; edits are spliced as bytes
+    with f:
+        try:
+            if os.fstat(f.fileno()).st_size > MMAP_MIN_SIZE:
+                content = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                content = f.read()
+        except Exception as e:
+            print(f"❌ Error reading file: {e}")
+            sys.exit(1)
     
-    print(f"📂 Reading: {args.dag_file}")
+    # Generate table names
+    table_names = []
+    for topic in topics:
+        table_name = generate_table_name(topic)
+        print(f"📊 Generated table name: {table_name}")
+        table_names.append(table_name)
     
-    # Read the DAG file
+    # Generate the new content; this also finds the existing configs
     try:
-        with open(dag_file, 'r') as f:
-            content = f.read()
+        new_content, existing_count, already_exists, start, old_end, new_end = (
+            add_many_stream_configs(content, table_names)
+        )
     except Exception as e:
-        print(f"❌ Error reading file: {e}")
+        print(f"❌ Error generating changes: {e}")
         sys.exit(1)
     
-    # Generate table name
-    table_name = generate_table_name(args.topic)
-    print(f"📊 Generated table name: {table_name}")
-    
-    # Check if config already exists
-    if check_config_exists(content, table_name):
+    # Check if configs already exist
+    for table_name in already_exists:
         print(f"\n⚠️  Stream config for '{table_name}' already exists in DAG")
+    
+    skipped = set(already_exists)
+    new_table_names = [t for t in dict.fromkeys(table_names) if t not in skipped]
+    if not new_table_names:
         print("ℹ️  No changes needed")
         sys.exit(0)
     
-    # Count existing configs
-    table_pattern = r'table="([^"]+)"'
-    existing_tables = re.findall(table_pattern, content)
-    existing_count = len(existing_tables)
     print(f"📊 Found {existing_count} existing StreamTaskConfig entries")
     
     # Preview the changes
-    preview_changes(table_name, existing_count)
+    preview_changes(new_table_names, existing_count)
     
-    # Generate the new content to show diff
     print(f"\n💾 Generating changes (preserving original formatting)...")
-    try:
-        new_content, _ = add_stream_config_to_file(content, table_name)
-    except Exception as e:
-        print(f"❌ Error generating changes: {e}")
-        sys.exit(1)
     
     # Show the diff
     print("\n" + "="*70)
     print("📝 EXACT FILE CHANGES (unified diff)")
     print("="*70)
     
-    original_lines = content.splitlines(keepends=True)
-    new_lines = new_content.splitlines(keepends=True)
+    # Only diff the edited window; line numbers are shifted back afterwards.
+    # difflib may slide the new entry across the identical lines around it, so
+    # widen the window by the entry's size to keep full context either way
+    original_lines, new_lines, first_line = _diff_window(
+        content, new_content, start, old_end, new_end,
+        DIFF_CONTEXT_LINES + new_content[start:new_end].count(b'\n') + 1
+    )
+    
+    # Imported here: the already-exists path never diffs
+    from difflib import unified_diff
     
     diff = unified_diff(
         original_lines,
         new_lines,
-        fromfile=f'{args.dag_file} (original)',
-        tofile=f'{args.dag_file} (modified)',
+        fromfile=f'{dag_file} (original)',
+        tofile=f'{dag_file} (modified)',
         lineterm=''
     )
     
     diff_lines = list(diff)
     if diff_lines:
+        color = _use_color(sys.stdout)
+        parts = []
         for line in diff_lines:
+            if line.startswith('@@'):
+                line = _shift_hunk_header(line, first_line)
+            
             # Color code the diff output
-            if line.startswith('+++') or line.startswith('---'):
-                print(f"\033[1m{line}\033[0m")  # Bold
-            elif line.startswith('+'):
-                print(f"\033[32m{line}\033[0m")  # Green
-            elif line.startswith('-'):
-                print(f"\033[31m{line}\033[0m")  # Red
-            elif line.startswith('@@'):
-                print(f"\033[36m{line}\033[0m")  # Cyan
-            else:
-                print(line)
+            code = DIFF_HEADER_COLOR if line.startswith(('+++', '---')) else DIFF_COLORS.get(line[:1])
+            parts.append(f"{code}{line}\033[0m\n" if color and code else f"{line}\n")
+        sys.stdout.write(''.join(parts))
     else:
         print("(No changes detected)")
     
     print("="*70)
     
-    if args.dry_run:
+    if dry_run:
         print("\n🔍 DRY RUN MODE - No changes written to file")
         print("✅ Run without --dry-run to apply changes")
         sys.exit(0)
@@ -236,8 +464,17 @@ def main():
     # Write the changes
     print(f"\n💾 Writing changes to file...")
     try:
-        with open(dag_file, 'w') as f:
-            f.write(new_content)
+        # Write a sibling temp file and swap it in, so the DAG is never half-written
+        # (and the mapped original is never truncated under us)
+        fd, tmp_path = tempfile.mkstemp(dir=dag_path.parent, prefix=f'.{dag_path.name}.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(new_content)
+            shutil.copymode(dag_path, tmp_path)
+            os.replace(tmp_path, dag_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
         
         print("✅ Successfully updated DAG file")
         print("ℹ️  Only the configs list was modified, all other formatting preserved")
@@ -246,5 +483,56 @@ def main():
         sys.exit(1)
 
 
+def main():
+    # Imported here so run() callers (parallel_pr_creator) don't pay for it
+    import argparse
+    
+    parser = argparse.ArgumentParser(
+        description='Add StreamTaskConfig to data-airflow DAG'
+    )
+    topic_args = parser.add_mutually_exclusive_group(required=True)
+    topic_args.add_argument(
+        '--topic',
+        help='Kafka topic name (e.g., customer.action.v1)'
+    )
+    topic_args.add_argument(
+        '--topics',
+        nargs='+',
+        metavar='TOPIC',
+        help='Several Kafka topic names, added in one pass over the DAG file'
+    )
+    topic_args.add_argument(
+        '--topics-file',
+        help='File with one Kafka topic name per line (blank lines and # comments ignored)'
+    )
+    parser.add_argument(
+        '--dag-file',
+        required=True,
+        help='Path to the DAG Python file'
+    )
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='Show what would be changed without modifying the file'
+    )
+    
+    args = parser.parse_args()
+    
+    if args.topic:
+        run(args.topic, args.dag_file, args.dry_run)
+        return
+    
+    topics = args.topics
+    if args.topics_file:
+        try:
+            lines = Path(args.topics_file).read_text(encoding='utf-8').splitlines()
+        except Exception as e:
+            print(f"❌ Error reading topics file: {e}")
+            sys.exit(1)
+        topics = [line.strip() for line in lines if line.strip() and not line.lstrip().startswith('#')]
+    
+    run_many(topics, args.dag_file, args.dry_run)
+
+
 if __name__ == '__main__':
     main()
@@ -4,14 +4,201 @@ Step 3: Create dbt extraction layer
 Adds source definition and creates staging model for Kafka topic data.
 """
 
-import argparse
+import atexit
+import functools
+import io
 import sys
-import yaml
 import json
 import os
+import re
+import threading
 from pathlib import Path
-from difflib import unified_diff
-from collections import defaultdict
+from collections import Counter, defaultdict
+
+try:
+    import orjson  # Optional: faster parsing of sampled record_content JSON
+except ImportError:
+    orjson = None
+
+DIFF_COLORS = {'+': '\033[32m', '-': '\033[31m', '@': '\033[36m'}  # Green, red, cyan
+DIFF_HEADER_COLOR = '\033[1m'
+DIFF_COLOR_RESET = '\033[0m'
+
+# orjson.JSONDecodeError subclasses json.JSONDecodeError, so callers catch the latter
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+# Sampled records fetched per round trip when parsing them locally
+FETCH_BATCH_SIZE = 1000
+
+# Stop parsing sampled records once this many in a row added no new field or
+# type, provided at least SCHEMA_MIN_RECORDS records have been parsed
+SCHEMA_STABLE_RECORDS = 20
+SCHEMA_MIN_RECORDS = 50
+
+# Sources files larger than this (in characters) get a line count instead of a diff
+DIFF_MAX_CHARS = 64 * 1024
+
+# `- name: <table>` entries in sources.yml, and the kafka_realtime source's own name line
+_TABLE_ENTRY_RE = re.compile(r'^([^\S\n]+)-[^\S\n]+name:[^\S\n]+(.+)$', re.MULTILINE)
+# The `tables:` key itself, not a comment or value that mentions it
+_TABLES_KEY_RE = re.compile(r'^[^\S\n]*tables:', re.MULTILINE)
+# A non-blank line that doesn't start with a space ends the tables section
+_SECTION_END_RE = re.compile(r'^(?! )[^\n]*\S', re.MULTILINE)
+_KAFKA_SOURCE_RE = re.compile(r'^\s*-?\s*name:\s*[\'"]?kafka_realtime[\'"]?\s*$', re.MULTILINE)
+
+# Field-name hints used by infer_snowflake_type (matched against the lowercased name)
+_TIMESTAMP_FIELD_RE = re.compile(r'timestamp|time|date|created|updated|modified')
+_BOOLEAN_FIELD_RE = re.compile(r'is_|has_|enabled|disabled|active')
+_NUMERIC_FIELD_RE = re.compile(r'count|amount|total|score|rating|version')
+# Casts for numeric-looking fields, by observed type, in priority order
+_NUMERIC_TYPE_CASTS = (('int', 'to_number'), ('float', 'to_double'))
+
+# Common array field names, checked first when picking the array to flatten
+_PRIORITY_ARRAY_FIELDS = ('applications', 'events', 'items', 'records', 'data', 'results')
+
+# Topic name patterns and their corresponding unique keys, in priority order
+_TOPIC_KEY_PATTERNS = [
+    ('device', 'device_id__sk', True),
+    ('feedback', 'feedback_id__sk', True),
+    ('customer', 'customer_id__sk', True),
+    ('compliance', 'compliance_id__sk', True),
+    ('vulnerability', 'vulnerability_id__sk', True),
+    ('threat', 'threat_id__sk', True),
+    ('agent', 'agent_id__sk', True),
+    ('experience', 'experience_id__sk', True),
+]
+# Lookahead so overlapping occurrences (e.g. 'agenthreat') are all found
+_TOPIC_KEY_RE = re.compile('(?=(' + '|'.join(re.escape(p) for p, _, _ in _TOPIC_KEY_PATTERNS) + '))')
+
+# Field names that are SQL reserved words and need quoting as column aliases
+_RESERVED_FIELD_NAMES = frozenset({'name', 'comment', 'order', 'group', 'user', 'version'})
+
+# Snowflake TYPEOF() names -> the Python type names used for sampled JSON values
+_VARIANT_TYPE_NAMES = {
+    'VARCHAR': 'str',
+    'BOOLEAN': 'bool',
+    'INTEGER': 'int',
+    'DECIMAL': 'float',
+    'DOUBLE': 'float',
+    'OBJECT': 'dict',
+    'ARRAY': 'list',
+    'NULL_VALUE': 'NoneType',
+}
+
+# One table's branch of the bulk sampling query; the branches are joined with UNION ALL
+# and each sampled row is tagged with the table it came from
+_BULK_SAMPLE_QUERY = """
+        SELECT * FROM (
+            SELECT '{table_name}' AS src, record_content
+            FROM {table_name}_processed
+            WHERE record_content IS NOT NULL
+            LIMIT {sample_size}
+        )"""
+
+# Fixed pieces of the generated dbt model, filled in with str.format where needed
+# Note: materialized='incremental' is set at project level in dbt_project.yml
+_MODEL_HEADER_TEMPLATE = """{{{{
+  config(
+        unique_key='{unique_key}',
+        tags=["{tag}"]
+  )
+}}}}
+
+select
+"""
+
+_SURROGATE_KEY_TEMPLATE = """    nvl2(
+        meta__kafka_headers:ce_id,
+        {{{{ dbt_utils.generate_surrogate_key([
+            'meta__kafka_headers:ce_id',
+            '{key_part}'
+        ]) }}}},
+        null
+    ) as {unique_key},
+"""
+
+_MODEL_META_COLUMNS = """    meta__kafka_topic,
+    meta__partition,
+    meta__offset,
+    meta__kafka_location,
+    meta__partition_offset_location__sk,
+    meta__kafka_timestamp,
+    meta__kafka_headers,
+    meta__kafka_key,
+    meta__kafka_key__sk,
+    meta__is_tombstone,
+    meta__materialized_at
+"""
+
+_MODEL_FROM_TEMPLATE = "from {{{{ source('kafka_realtime', '{table_name}_processed') }}}}"
+_MODEL_FLATTEN_TEMPLATE = ",\n    lateral flatten(input => record_content:{array_field}) as app"
+
+_MODEL_INCREMENTAL_FILTER = """
+
+{% if is_incremental() %}
+    WHERE meta__materialized_at > (
+        SELECT max(meta__materialized_at)
+        FROM {{ this }}
+    )
+{% endif %}
+"""
+
+# While sampling, the types seen for a field are kept as a bitmask with one bit per
+# Python type name; _bits_to_names turns a mask back into the set of names
+_TYPE_BITS = {
+    name: 1 << i
+    for i, name in enumerate(['str', 'int', 'float', 'bool', 'dict', 'list', 'NoneType'])
+}
+# Guards registering new names in _TYPE_BITS; discover_schemas_parallel samples from threads
+_TYPE_BITS_LOCK = threading.Lock()
+
+
+def _type_bit(type_name):
+    """Bit for a type name, registering a new bit for names outside _TYPE_BITS."""
+    bit = _TYPE_BITS.get(type_name)
+    if bit is None:
+        with _TYPE_BITS_LOCK:
+            bit = _TYPE_BITS.setdefault(type_name, 1 << len(_TYPE_BITS))
+    return bit
+
+
+def _bits_to_names(mask):
+    """Set of type names whose bits are set in mask."""
+    return {name for name, bit in list(_TYPE_BITS.items()) if mask & bit}
+
+
+# Field statistics for a sample of record_content, computed in Snowflake. Rows are
+# (array_field, field, value_type, records, non_empty_arrays): top-level fields have
+# a NULL array_field, fields of an array's first element name the array, and one
+# row with a NULL field carries the number of sampled records.
+_SCHEMA_STATS_QUERY = """
+        WITH sampled AS (
+            SELECT record_content
+            FROM {source_table}
+            WHERE record_content IS NOT NULL
+            LIMIT {sample_size}
+        )
+        SELECT NULL, f.key, TYPEOF(f.value), COUNT(*), COUNT_IF(ARRAY_SIZE(f.value) > 0)
+        FROM sampled, LATERAL FLATTEN(input => sampled.record_content) f
+        WHERE IS_OBJECT(sampled.record_content)
+        GROUP BY 1, 2, 3
+        UNION ALL
+        SELECT f.key, n.key, TYPEOF(n.value), COUNT(*), 0
+        FROM sampled,
+            LATERAL FLATTEN(input => sampled.record_content) f,
+            LATERAL FLATTEN(input => f.value[0]) n
+        WHERE IS_OBJECT(sampled.record_content) AND IS_ARRAY(f.value) AND IS_OBJECT(f.value[0])
+        GROUP BY 1, 2, 3
+        UNION ALL
+        SELECT NULL, NULL, NULL, COUNT(*), 0
+        FROM sampled
+        """
+
+
+def _color_diff_line(line):
+    """Return a unified diff line, newline-terminated and color coded for a terminal."""
+    code = DIFF_HEADER_COLOR if line.startswith(('+++', '---')) else DIFF_COLORS.get(line[:1])
+    return f"{code}{line}{DIFF_COLOR_RESET}\n" if code else f"{line}\n"
 
 
 def generate_table_name(topic):
@@ -38,6 +225,312 @@ def generate_source_config(table_name):
     return config
 
 
+# Open Snowflake connections, keyed by connection parameters, so several
+# discoveries in one process share a session (and a single SSO login)
+_CONNECTIONS = {}
+
+
+def _close_all_connections():
+    """Close every cached Snowflake connection."""
+    while _CONNECTIONS:
+        _, conn = _CONNECTIONS.popitem()
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+atexit.register(_close_all_connections)
+
+
+def _get_conn(conn_params):
+    """
+    Return a cached Snowflake connection for these parameters, connecting on first use.
+    
+    Args:
+        conn_params: Keyword arguments for snowflake.connector.connect
+        
+    Returns:
+        An open snowflake.connector connection
+    """
+    import snowflake.connector
+    
+    key = tuple(sorted(conn_params.items()))
+    conn = _CONNECTIONS.get(key)
+    if conn is None or conn.is_closed():
+        conn = snowflake.connector.connect(**conn_params, client_session_keep_alive=True)
+        _CONNECTIONS[key] = conn
+    return conn
+
+
+def _sample_field_stats_in_snowflake(cursor, source_table, sample_size):
+    """
+    Collect field statistics for a sample of record_content with one query,
+    letting Snowflake unnest the JSON instead of transferring and parsing it.
+    
+    Returns:
+        (field_counts, field_types, nested_field_counts, nested_field_types,
+        array_fields, total_records), as _sample_field_stats_locally does.
+        Nested counts and types are keyed by (array_field, nested_field), and
+        types are _TYPE_BITS masks.
+    """
+    query = _SCHEMA_STATS_QUERY.format(source_table=source_table, sample_size=sample_size)
+    
+    print(f"   Executing: {query}")
+    cursor.execute(query)
+    
+    field_counts = Counter()
+    field_types = defaultdict(int)
+    nested_field_counts = Counter()
+    nested_field_types = defaultdict(int)
+    array_fields = set()
+    total_records = 0
+    
+    for array_field, field_name, value_type, records, non_empty_arrays in cursor:
+        # The total-count row has no field (and no type)
+        if field_name is None:
+            total_records = records
+            continue
+        
+        type_bit = _type_bit(_VARIANT_TYPE_NAMES.get(value_type, str(value_type).lower()))
+        if array_field is None:
+            field_counts[field_name] += records
+            field_types[field_name] |= type_bit
+            if non_empty_arrays:
+                array_fields.add(field_name)
+        else:
+            nested_field_counts[array_field, field_name] += records
+            nested_field_types[array_field, field_name] |= type_bit
+    
+    return field_counts, field_types, nested_field_counts, nested_field_types, array_fields, total_records
+
+
+def _sample_field_stats_locally(cursor, source_table, sample_size):
+    """
+    Collect field statistics by fetching sampled record_content values and parsing them.
+    
+    Returns:
+        (field_counts, field_types, nested_field_counts, nested_field_types,
+        array_fields, total_records), with nested counts and types keyed by
+        (array_field, nested_field)
+    """
+    # Query sample records
+    query = f"""
+        SELECT record_content
+        FROM {source_table}
+        WHERE record_content IS NOT NULL
+        LIMIT {sample_size}
+        """
+    
+    print(f"   Executing: {query}")
+    cursor.execute(query)
+    
+    return _field_stats_from_records(record_content for (record_content,) in _iter_fetched(cursor))
+
+
+def _iter_fetched(cursor):
+    """Yield the rows of an executed query, fetching FETCH_BATCH_SIZE rows per round trip."""
+    while True:
+        rows = cursor.fetchmany(FETCH_BATCH_SIZE)
+        if not rows:
+            return
+        yield from rows
+
+
+def _field_stats_from_records(records):
+    """
+    Collect field statistics from sampled record_content values (JSON strings or dicts).
+    Stops early once the discovered fields and types have stopped changing.
+    
+    Returns:
+        (field_counts, field_types, nested_field_counts, nested_field_types,
+        array_fields, total_records), with nested counts and types keyed by
+        (array_field, nested_field) and types as _TYPE_BITS masks
+    """
+    # Collect all field names from sampled records
+    field_counts = Counter()
+    field_types = defaultdict(int)
+    nested_field_counts = Counter()
+    nested_field_types = defaultdict(int)
+    array_fields = set()
+    total_records = 0
+    stable_records = 0
+    
+    for record_content in records:
+        if record_content:
+            try:
+                # Parse JSON if it's a string
+                if isinstance(record_content, str):
+                    data = _json_loads(record_content)
+                else:
+                    data = record_content
+                
+                changed = False
+                
+                # Collect field names and types
+                if isinstance(data, dict):
+                    field_counts.update(data.keys())
+                    for field_name, field_value in data.items():
+                        type_bit = _type_bit(type(field_value).__name__)
+                        if not field_types[field_name] & type_bit:
+                            field_types[field_name] |= type_bit
+                            changed = True
+                        
+                        # If this is a list/array, also inspect its nested structure
+                        if isinstance(field_value, list) and len(field_value) > 0:
+                            if field_name not in array_fields:
+                                array_fields.add(field_name)
+                                changed = True
+                            # Sample first item in the array to discover nested fields
+                            first_item = field_value[0]
+                            if isinstance(first_item, dict):
+                                # These are the fields within the array that we'd flatten
+                                nested_field_counts.update((field_name, nested_field) for nested_field in first_item)
+                                for nested_field, nested_value in first_item.items():
+                                    nested_key = (field_name, nested_field)
+                                    type_bit = _type_bit(type(nested_value).__name__)
+                                    if not nested_field_types[nested_key] & type_bit:
+                                        nested_field_types[nested_key] |= type_bit
+                                        changed = True
+                
+                total_records += 1
+            except json.JSONDecodeError:
+                continue
+            
+            stable_records = 0 if changed else stable_records + 1
+            if stable_records >= SCHEMA_STABLE_RECORDS and total_records >= SCHEMA_MIN_RECORDS:
+                print(f"   Schema stable after {total_records} records, skipping the rest of the sample")
+                break
+    
+    return field_counts, field_types, nested_field_counts, nested_field_types, array_fields, total_records
+
+
+def _sample_field_stats(conn, source_table, sample_size):
+    """
+    Collect field statistics for a sample of source_table on its own cursor.
+    
+    Returns:
+        (field_counts, field_types, nested_field_counts, nested_field_types,
+        array_fields, total_records)
+    """
+    cursor = conn.cursor()
+    
+    # Aggregate the sample in Snowflake; if that fails (e.g. record_content
+    # isn't a VARIANT), fetch the records and parse them here instead
+    try:
+        try:
+            return _sample_field_stats_in_snowflake(cursor, source_table, sample_size)
+        except Exception as e:
+            print(f"   Server-side schema sampling failed ({e}), parsing records locally")
+            return _sample_field_stats_locally(cursor, source_table, sample_size)
+    finally:
+        cursor.close()
+
+
+def _snowflake_conn_params(snowflake_config):
+    """Build snowflake.connector.connect keyword arguments from the script's Snowflake config."""
+    # Build connection parameters
+    conn_params = {
+        'account': snowflake_config.get('account'),
+        'user': snowflake_config.get('user'),
+        'warehouse': snowflake_config.get('warehouse'),
+        'database': snowflake_config.get('database'),
+        'schema': snowflake_config.get('schema'),
+    }
+    
+    # Add optional parameters
+    if snowflake_config.get('role'):
+        conn_params['role'] = snowflake_config.get('role')
+    
+    # Handle authentication
+    authenticator = snowflake_config.get('authenticator')
+    if authenticator:
+        conn_params['authenticator'] = authenticator
+        if authenticator.lower() == 'externalbrowser':
+            print("   Using external browser authentication (SSO)...")
+    elif snowflake_config.get('password'):
+        conn_params['password'] = snowflake_config.get('password')
+    else:
+        # Default to externalbrowser if no password provided
+        conn_params['authenticator'] = 'externalbrowser'
+        print("   Using external browser authentication (SSO)...")
+    
+    return conn_params
+
+
+def _summarize_schema(stats):
+    """
+    Pick the discovered fields out of sampled field statistics and print a summary.
+    
+    Returns:
+        (fields, field_types, array_field_name), or None if no records were sampled
+    """
+    field_counts, field_types, nested_field_counts, nested_field_types, array_fields, total_records = stats
+    
+    # Type bitmasks -> sets of type names, as returned to callers
+    field_types = {field: _bits_to_names(mask) for field, mask in field_types.items()}
+    
+    if total_records == 0:
+        print("⚠️  No records found in table")
+        return None
+    
+    # Determine which array to use (prioritize common array names)
+    primary_array = None
+    
+    for priority in _PRIORITY_ARRAY_FIELDS:
+        if priority in array_fields:
+            primary_array = priority
+            break
+    
+    if primary_array is None and array_fields:
+        primary_array = list(array_fields)[0]
+    
+    # If we detected an array with nested fields, return those nested fields
+    nested_counts = Counter()
+    if primary_array:
+        nested_counts = Counter({
+            nested_field: count
+            for (array_field, nested_field), count in nested_field_counts.items()
+            if array_field == primary_array
+        })
+    
+    if nested_counts:
+        discovered_fields = [field for field, _ in nested_counts.most_common()]
+        discovered_types = {
+            nested_field: _bits_to_names(mask)
+            for (array_field, nested_field), mask in nested_field_types.items()
+            if array_field == primary_array
+        }
+        
+        print(f"\n✅ Discovered array field '{primary_array}' with {len(discovered_fields)} nested fields from {total_records} records:")
+        print("─" * 70)
+        for field in discovered_fields:
+            frequency = nested_counts[field]
+            percentage = (frequency / total_records) * 100
+            types = ', '.join(sorted(discovered_types[field]))
+            print(f"   • {field:30s} ({frequency:3d}/{total_records} = {percentage:5.1f}%) [{types}]")
+        print("─" * 70)
+        
+        # Return: (fields, field_types, array_field_name)
+        return discovered_fields, discovered_types, primary_array
+    
+    # Otherwise, return top-level fields
+    discovered_fields = [field for field, _ in field_counts.most_common()]
+    
+    print(f"\n✅ Discovered {len(discovered_fields)} top-level fields from {total_records} records:")
+    print("─" * 70)
+    for field in discovered_fields:
+        frequency = field_counts[field]
+        percentage = (frequency / total_records) * 100
+        types = ', '.join(sorted(field_types[field]))
+        marker = " [array]" if field in array_fields else ""
+        print(f"   • {field:30s} ({frequency:3d}/{total_records} = {percentage:5.1f}%) [{types}]{marker}")
+    print("─" * 70)
+    
+    # Return: (fields, field_types, array_field_name=None)
+    return discovered_fields, field_types, None
+
+
 def discover_schema_from_snowflake(table_name, snowflake_config, sample_size=100):
     """
     Connect to Snowflake and discover the schema of record_content by sampling records.
@@ -63,147 +556,132 @@ def discover_schema_from_snowflake(table_name, snowflake_config, sample_size=100
     print(f"   Sampling {sample_size} records...")
     
     try:
-        # Build connection parameters
-        conn_params = {
-            'account': snowflake_config.get('account'),
-            'user': snowflake_config.get('user'),
-            'warehouse': snowflake_config.get('warehouse'),
-            'database': snowflake_config.get('database'),
-            'schema': snowflake_config.get('schema'),
-        }
+        conn_params = _snowflake_conn_params(snowflake_config)
         
-        # Add optional parameters
-        if snowflake_config.get('role'):
-            conn_params['role'] = snowflake_config.get('role')
-        
-        # Handle authentication
-        authenticator = snowflake_config.get('authenticator')
-        if authenticator:
-            conn_params['authenticator'] = authenticator
-            if authenticator.lower() == 'externalbrowser':
-                print("   Using external browser authentication (SSO)...")
-        elif snowflake_config.get('password'):
-            conn_params['password'] = snowflake_config.get('password')
-        else:
-            # Default to externalbrowser if no password provided
-            conn_params['authenticator'] = 'externalbrowser'
-            print("   Using external browser authentication (SSO)...")
+        # Connect to Snowflake (reusing an open session when there is one)
+        conn = _get_conn(conn_params)
         
-        # Connect to Snowflake
-        conn = snowflake.connector.connect(**conn_params)
+        stats = _sample_field_stats(conn, source_table, sample_size)
         
-        cursor = conn.cursor()
+        return _summarize_schema(stats)
         
-        # Query sample records
-        query = f"""
-        SELECT record_content
-        FROM {source_table}
-        WHERE record_content IS NOT NULL
-        LIMIT {sample_size}
-        """
+    except Exception as e:
+        print(f"⚠️  Schema discovery failed: {e}")
+        print(f"   Will use default or provided fields instead")
+        return None
+
+
+def discover_schemas_bulk(table_names, snowflake_config, sample_size=100):
+    """
+    Discover the record_content schemas of several tables with a single sampling query.
+    
+    Args:
+        table_names: Base table names (without _processed suffix)
+        snowflake_config: Dict with Snowflake connection parameters
+        sample_size: Number of records to sample per table
+        
+    Returns:
+        Dict mapping each table name to what discover_schema_from_snowflake
+        returns for it (None where discovery failed)
+    """
+    results = dict.fromkeys(table_names)
+    if not results:
+        return results
+    
+    try:
+        import snowflake.connector
+    except ImportError:
+        print("⚠️  snowflake-connector-python not installed. Install with:")
+        print("   pip install snowflake-connector-python")
+        return results
+    
+    print(f"\n🔍 Discovering schemas for {len(results)} tables from Snowflake")
+    print(f"   Sampling {sample_size} records per table...")
+    
+    query = "\n        UNION ALL".join(
+        _BULK_SAMPLE_QUERY.format(table_name=table_name, sample_size=sample_size)
+        for table_name in results
+    )
+    
+    try:
+        conn = _get_conn(_snowflake_conn_params(snowflake_config))
+        cursor = conn.cursor()
         
         print(f"   Executing: {query}")
         cursor.execute(query)
         
-        # Collect all field names from sampled records
-        field_counts = defaultdict(int)
-        field_types = defaultdict(set)
-        nested_field_counts = defaultdict(lambda: defaultdict(int))
-        nested_field_types = defaultdict(lambda: defaultdict(set))
-        array_fields = set()
-        total_records = 0
-        
-        for row in cursor:
-            record_content = row[0]
-            if record_content:
-                try:
-                    # Parse JSON if it's a string
-                    if isinstance(record_content, str):
-                        data = json.loads(record_content)
-                    else:
-                        data = record_content
-                    
-                    # Collect field names and types
-                    if isinstance(data, dict):
-                        for field_name, field_value in data.items():
-                            field_counts[field_name] += 1
-                            field_types[field_name].add(type(field_value).__name__)
-                            
-                            # If this is a list/array, also inspect its nested structure
-                            if isinstance(field_value, list) and len(field_value) > 0:
-                                array_fields.add(field_name)
-                                # Sample first item in the array to discover nested fields
-                                first_item = field_value[0]
-                                if isinstance(first_item, dict):
-                                    # These are the fields within the array that we'd flatten
-                                    for nested_field, nested_value in first_item.items():
-                                        nested_field_counts[field_name][nested_field] += 1
-                                        nested_field_types[field_name][nested_field].add(type(nested_value).__name__)
-                    
-                    total_records += 1
-                except json.JSONDecodeError:
-                    continue
+        # Bucket the sampled records by the table they came from
+        records_by_table = defaultdict(list)
+        for src, record_content in _iter_fetched(cursor):
+            records_by_table[src].append(record_content)
         
         cursor.close()
-        conn.close()
-        
-        if total_records == 0:
-            print("⚠️  No records found in table")
-            return None
-        
-        # Determine which array to use (prioritize common array names)
-        primary_array = None
-        priority_arrays = ['applications', 'events', 'items', 'records', 'data', 'results']
-        
-        for priority in priority_arrays:
-            if priority in array_fields:
-                primary_array = priority
-                break
-        
-        if primary_array is None and array_fields:
-            primary_array = list(array_fields)[0]
-        
-        # If we detected an array with nested fields, return those nested fields
-        if primary_array and primary_array in nested_field_counts:
-            discovered_fields = sorted(
-                nested_field_counts[primary_array].keys(),
-                key=lambda x: nested_field_counts[primary_array][x],
-                reverse=True
-            )
-            discovered_types = nested_field_types[primary_array]
-            
-            print(f"\n✅ Discovered array field '{primary_array}' with {len(discovered_fields)} nested fields from {total_records} records:")
-            print("─" * 70)
-            for field in discovered_fields:
-                frequency = nested_field_counts[primary_array][field]
-                percentage = (frequency / total_records) * 100
-                types = ', '.join(sorted(discovered_types[field]))
-                print(f"   • {field:30s} ({frequency:3d}/{total_records} = {percentage:5.1f}%) [{types}]")
-            print("─" * 70)
-            
-            # Return: (fields, field_types, array_field_name)
-            return discovered_fields, discovered_types, primary_array
-        
-        # Otherwise, return top-level fields
-        discovered_fields = sorted(field_counts.keys(), key=lambda x: field_counts[x], reverse=True)
-        
-        print(f"\n✅ Discovered {len(discovered_fields)} top-level fields from {total_records} records:")
-        print("─" * 70)
-        for field in discovered_fields:
-            frequency = field_counts[field]
-            percentage = (frequency / total_records) * 100
-            types = ', '.join(sorted(field_types[field]))
-            marker = " [array]" if field in array_fields else ""
-            print(f"   • {field:30s} ({frequency:3d}/{total_records} = {percentage:5.1f}%) [{types}]{marker}")
-        print("─" * 70)
-        
-        # Return: (fields, field_types, array_field_name=None)
-        return discovered_fields, field_types, None
+    except Exception as e:
+        print(f"⚠️  Bulk schema discovery failed: {e}")
+        print(f"   Will use default or provided fields instead")
+        return results
+    
+    for table_name in results:
+        print(f"\n🔍 Schema for Snowflake table: {table_name}_processed")
+        results[table_name] = _summarize_schema(_field_stats_from_records(records_by_table[table_name]))
+    
+    return results
+
+
+def discover_schemas_parallel(table_names, snowflake_config, sample_size=100, max_workers=8):
+    """
+    Discover the record_content schemas of several tables with concurrent queries.
+    
+    The tables are sampled on worker threads, each with its own cursor on one shared
+    connection (so there is a single login), and summarized in order afterwards.
+    
+    Args:
+        table_names: Base table names (without _processed suffix)
+        snowflake_config: Dict with Snowflake connection parameters
+        sample_size: Number of records to sample per table
+        max_workers: Maximum number of concurrent sampling queries
         
+    Returns:
+        Dict mapping each table name to what discover_schema_from_snowflake
+        returns for it (None where discovery failed)
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    
+    results = dict.fromkeys(table_names)
+    if not results:
+        return results
+    
+    try:
+        import snowflake.connector
+    except ImportError:
+        print("⚠️  snowflake-connector-python not installed. Install with:")
+        print("   pip install snowflake-connector-python")
+        return results
+    
+    print(f"\n🔍 Discovering schemas for {len(results)} tables from Snowflake")
+    print(f"   Sampling {sample_size} records per table...")
+    
+    try:
+        conn = _get_conn(_snowflake_conn_params(snowflake_config))
     except Exception as e:
         print(f"⚠️  Schema discovery failed: {e}")
         print(f"   Will use default or provided fields instead")
-        return None
+        return results
+    
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(results))) as executor:
+        futures = {
+            table_name: executor.submit(_sample_field_stats, conn, f"{table_name}_processed", sample_size)
+            for table_name in results
+        }
+    
+    for table_name, future in futures.items():
+        print(f"\n🔍 Schema for Snowflake table: {table_name}_processed")
+        try:
+            results[table_name] = _summarize_schema(future.result())
+        except Exception as e:
+            print(f"⚠️  Schema discovery failed: {e}")
+    
+    return results
 
 
 def infer_unique_key_from_fields(field_list):
@@ -221,7 +699,7 @@ def infer_unique_key_from_fields(field_list):
         return None
     
     # Convert to lowercase for case-insensitive matching
-    fields_lower = [f.lower() for f in field_list]
+    fields_lower = {f.lower() for f in field_list}
     
     # Conservative list: IDs that should be part of the unique key
     # NOT foreign keys like cve_id, tenant_id, device_id (those aren't unique per record)
@@ -259,28 +737,42 @@ def infer_unique_key_from_topic(topic):
     Returns:
         Tuple of (unique_key_name, needs_surrogate_key)
     """
-    topic_lower = topic.lower()
+    # Every pattern occurring in the topic, found in one scan; the first in list order wins
+    found = set(_TOPIC_KEY_RE.findall(topic.lower()))
     
-    # Define patterns and their corresponding unique keys
-    patterns = [
-        ('device', 'device_id__sk', True),
-        ('feedback', 'feedback_id__sk', True),
-        ('customer', 'customer_id__sk', True),
-        ('compliance', 'compliance_id__sk', True),
-        ('vulnerability', 'vulnerability_id__sk', True),
-        ('threat', 'threat_id__sk', True),
-        ('agent', 'agent_id__sk', True),
-        ('experience', 'experience_id__sk', True),
-    ]
-    
-    for pattern, key_name, needs_surrogate in patterns:
-        if pattern in topic_lower:
-            return key_name, needs_surrogate
+    if found:
+        for pattern, key_name, needs_surrogate in _TOPIC_KEY_PATTERNS:
+            if pattern in found:
+                return key_name, needs_surrogate
     
     # Default: use generic event_id__sk
     return 'event_id__sk', True
 
 
+@functools.lru_cache(maxsize=4096)
+def _field_name_type_hints(field_name):
+    """
+    The parts of infer_snowflake_type that depend only on the field name, cached per name.
+    
+    Returns:
+        Tuple of (cast_func or None, looks_numeric, is_id_field)
+    """
+    field_lower = field_name.lower()
+    
+    # Timestamp/date fields
+    if _TIMESTAMP_FIELD_RE.search(field_lower):
+        return 'to_timestamp_ntz', False, False
+    
+    # Boolean fields
+    if _BOOLEAN_FIELD_RE.search(field_lower):
+        return 'to_boolean', False, False
+    
+    # Numeric fields (cast depends on observed types); ID fields - keep as varchar
+    looks_numeric = _NUMERIC_FIELD_RE.search(field_lower) is not None
+    is_id_field = field_lower.endswith('_id') or field_lower == 'id'
+    return None, looks_numeric, is_id_field
+
+
 def infer_snowflake_type(field_name, python_types):
     """
     Infer appropriate Snowflake type based on field name and observed Python types.
@@ -292,25 +784,18 @@ def infer_snowflake_type(field_name, python_types):
     Returns:
         Snowflake cast function (e.g., 'to_varchar', 'to_number')
     """
-    field_lower = field_name.lower()
-    
-    # Timestamp/date fields
-    if any(x in field_lower for x in ['timestamp', 'time', 'date', 'created', 'updated', 'modified']):
-        return 'to_timestamp_ntz'
-    
-    # Boolean fields
-    if any(x in field_lower for x in ['is_', 'has_', 'enabled', 'disabled', 'active']):
-        return 'to_boolean'
+    cast_func, looks_numeric, is_id_field = _field_name_type_hints(field_name)
+    if cast_func:
+        return cast_func
     
     # Numeric fields
-    if any(x in field_lower for x in ['count', 'amount', 'total', 'score', 'rating', 'version']):
-        if 'int' in python_types:
-            return 'to_number'
-        elif 'float' in python_types:
-            return 'to_double'
+    if looks_numeric:
+        for type_name, numeric_cast in _NUMERIC_TYPE_CASTS:
+            if type_name in python_types:
+                return numeric_cast
     
     # ID fields - keep as varchar
-    if field_lower.endswith('_id') or field_lower == 'id':
+    if is_id_field:
         return 'to_varchar'
     
     # Default to varchar for strings, variant for complex types
@@ -330,11 +815,8 @@ def detect_array_field(field_types):
     if not field_types:
         return None, False
     
-    # Common array field names to check first
-    priority_arrays = ['applications', 'events', 'items', 'records', 'data', 'results']
-    
     # Check priority arrays first
-    for field_name in priority_arrays:
+    for field_name in _PRIORITY_ARRAY_FIELDS:
         if field_name in field_types and 'list' in field_types[field_name]:
             return field_name, True
     
@@ -346,25 +828,38 @@ def detect_array_field(field_types):
     return None, False
 
 
+def _canonical_fields(fields):
+    """Return fields (comma-separated string or sequence of names) as a tuple of names."""
+    if isinstance(fields, str):
+        return tuple(f for f in map(str.strip, fields.split(',')) if f)
+    return tuple(fields) if fields else ()
+
+
 def generate_dbt_model(table_name, model_name, fields, topic='', field_types=None, flatten_array=None):
     """
     Generate the dbt SQL model with incremental materialization and dynamic unique_key.
+    Takes the same arguments as write_dbt_model and returns the SQL as a string.
+    """
+    out = io.StringIO()
+    write_dbt_model(out, table_name, model_name, fields, topic, field_types, flatten_array)
+    return out.getvalue()
+
+
+def write_dbt_model(out, table_name, model_name, fields, topic='', field_types=None, flatten_array=None):
+    """
+    Write the dbt SQL model with incremental materialization and dynamic unique_key
+    to out, piece by piece.
     
     Args:
+        out: Text writer (file, io.StringIO, ...) the SQL is written to
         table_name: Snowflake table name
         model_name: dbt model name
-        fields: List or comma-separated string of field names
+        fields: List, tuple or comma-separated string of field names
         topic: Original Kafka topic name (for unique_key inference)
         field_types: Optional dict mapping field names to observed Python types
         flatten_array: Optional array field name to flatten (auto-detected if None)
     """
-    # Handle both string (comma-separated) and list inputs
-    if isinstance(fields, str):
-        field_list = [f.strip() for f in fields.split(',') if f.strip()]
-    elif isinstance(fields, list):
-        field_list = fields
-    else:
-        field_list = []
+    field_list = _canonical_fields(fields)
     
     # Check for override_id in fields - auto-detect and use it in surrogate key
     base_id_field = None
@@ -393,33 +888,35 @@ def generate_dbt_model(table_name, model_name, fields, topic='', field_types=Non
     # Generate surrogate key if needed
     surrogate_key_sql = ""
     
-    if needs_surrogate:
-        # Build surrogate key - if we have a base_id_field, include it
-        if base_id_field:
-            # Special case: combine ce_id + field_id for uniqueness
-            surrogate_key_sql = f"""    nvl2(
-        meta__kafka_headers:ce_id,
-        {{{{ dbt_utils.generate_surrogate_key([
-            'meta__kafka_headers:ce_id',
-            '{extraction_source}:{base_id_field}'
-        ]) }}}},
-        null
-    ) as {unique_key},
-"""
-        else:
-            # Standard surrogate key with ce_id + partition offset
-            surrogate_key_sql = f"""    nvl2(
-        meta__kafka_headers:ce_id,
-        {{{{ dbt_utils.generate_surrogate_key([
-            'meta__kafka_headers:ce_id',
-            'meta__partition_offset_location__sk'
-        ]) }}}},
-        null
-    ) as {unique_key},
-"""
+    if needs_surrogate:
+        # Build surrogate key - if we have a base_id_field, include it
+        if base_id_field:
+            # Special case: combine ce_id + field_id for uniqueness
+            key_part = f"{extraction_source}:{base_id_field}"
+        else:
+            # Standard surrogate key with ce_id + partition offset
+            key_part = 'meta__partition_offset_location__sk'
+        surrogate_key_sql = _SURROGATE_KEY_TEMPLATE.format(key_part=key_part, unique_key=unique_key)
+    
+    # Build FROM clause
+    from_clause = _MODEL_FROM_TEMPLATE.format(table_name=table_name)
+    if uses_flatten:
+        from_clause += _MODEL_FLATTEN_TEMPLATE.format(array_field=array_field)
+    
+    # Determine appropriate tag based on topic
+    topic_lower = topic.lower()
+    if 'vulnerability' in topic_lower or 'vulnerability_management' in topic_lower:
+        tag = 'vulnerability'
+    else:
+        tag = 'kafka_extracted'
+    
+    # Write the model SQL, field extractions written as we go
+    out.write(_MODEL_HEADER_TEMPLATE.format(unique_key=unique_key, tag=tag))
+    out.write(surrogate_key_sql)
+    wrote_extractions = bool(base_id_field)
     
     # Generate field extractions with proper type casting
-    field_extractions = []
+    base_id_lower = base_id_field.lower() if base_id_field else None
     
     # If we have a base_id_field, extract it first (right after surrogate key)
     if base_id_field:
@@ -429,17 +926,17 @@ def generate_dbt_model(table_name, model_name, fields, topic='', field_types=Non
             cast_func = 'to_varchar'
         
         if cast_func == 'variant':
-            field_extractions.append(f"    {extraction_source}:{base_id_field}::variant as {base_id_field},")
+            out.write(f"    {extraction_source}:{base_id_field}::variant as {base_id_field},\n")
         else:
-            field_extractions.append(f"    {cast_func}({extraction_source}:{base_id_field}) as {base_id_field},")
+            out.write(f"    {cast_func}({extraction_source}:{base_id_field}) as {base_id_field},\n")
     
-    for field in field_list:
+    for field, field_lower in zip(field_list, fields_lower):
         # Skip the array field itself if we're flattening it
         if uses_flatten and field == array_field:
             continue
         
         # Skip the base ID field if we already added it at the top
-        if base_id_field and field.lower() == base_id_field.lower():
+        if field_lower == base_id_lower:
             continue
         
         # Determine the appropriate Snowflake type
@@ -449,168 +946,165 @@ def generate_dbt_model(table_name, model_name, fields, topic='', field_types=Non
             cast_func = 'to_varchar'
         
         # Handle field names that might be SQL reserved words
-        field_alias = f'"{field}"' if field.lower() in ['name', 'comment', 'order', 'group', 'user', 'version'] else field
+        field_alias = f'"{field}"' if field_lower in _RESERVED_FIELD_NAMES else field
         
         if cast_func == 'variant':
-            field_extractions.append(f"    {extraction_source}:{field}::variant as {field_alias},")
+            out.write(f"    {extraction_source}:{field}::variant as {field_alias},\n")
         else:
-            field_extractions.append(f"    {cast_func}({extraction_source}:{field}) as {field_alias},")
-    
-    # Build FROM clause
-    if uses_flatten:
-        from_clause = f"""from {{{{ source('kafka_realtime', '{table_name}_processed') }}}},
-    lateral flatten(input => record_content:{array_field}) as app"""
-    else:
-        from_clause = f"""from {{{{ source('kafka_realtime', '{table_name}_processed') }}}}"""
+            out.write(f"    {cast_func}({extraction_source}:{field}) as {field_alias},\n")
+        wrote_extractions = True
     
-    # Determine appropriate tag based on topic
-    topic_lower = topic.lower()
-    if 'vulnerability' in topic_lower or 'vulnerability_management' in topic_lower:
-        tag = 'vulnerability'
-    else:
-        tag = 'kafka_extracted'
+    # With no extractions the select list still starts on its own line
+    if not wrote_extractions:
+        out.write("\n")
     
-    # Build the model SQL
-    # Note: materialized='incremental' is set at project level in dbt_project.yml
-    model_sql = f"""{{{{
-  config(
-        unique_key='{unique_key}',
-        tags=["{tag}"]
-  )
-}}}}
+    out.write(_MODEL_META_COLUMNS)
+    out.write(from_clause)
+    out.write(_MODEL_INCREMENTAL_FILTER)
 
-select
-{surrogate_key_sql}{chr(10).join(field_extractions)}
-    meta__kafka_topic,
-    meta__partition,
-    meta__offset,
-    meta__kafka_location,
-    meta__partition_offset_location__sk,
-    meta__kafka_timestamp,
-    meta__kafka_headers,
-    meta__kafka_key,
-    meta__kafka_key__sk,
-    meta__is_tombstone,
-    meta__materialized_at
-{from_clause}
 
-{{% if is_incremental() %}}
-    WHERE meta__materialized_at > (
-        SELECT max(meta__materialized_at)
-        FROM {{{{ this }}}}
-    )
-{{% endif %}}
-"""
+@functools.lru_cache(maxsize=8)
+def _load_sources(content):
+    """Parsed sources.yml content, cached so the same text is only parsed once."""
+    # Imported here: runs where the source is clearly new never parse YAML
+    import yaml
+    try:
+        from yaml import CSafeLoader as YamlLoader  # libyaml-backed, when PyYAML was built with it
+    except ImportError:
+        from yaml import SafeLoader as YamlLoader
     
-    return model_sql
+    return yaml.load(content, Loader=YamlLoader)
 
 
-def add_source_to_yaml(sources_file, table_name, dry_run=False):
+def add_source_to_yaml(sources_file, table_name, dry_run=False, return_contents=True):
     """
     Add the source to sources.yml with minimal changes.
     Only adds the table name entry in alphabetical order, preserving all formatting.
     """
-    import re
+    added, original_content, new_content = add_sources_to_yaml(
+        sources_file, [table_name], dry_run, return_contents
+    )
+    return bool(added), original_content, new_content
+
+
+def add_sources_to_yaml(sources_file, table_names, dry_run=False, return_contents=True):
+    """
+    Add several sources to sources.yml, reading, parsing and writing the file once.
+    Each table name entry goes in alphabetical order, preserving all formatting.
     
+    Returns:
+        Tuple of (added_table_names, original_content, new_content); the contents
+        are None if nothing was added, or if return_contents is False (no diff wanted)
+    """
     print(f"\n📂 Processing sources file: {sources_file}")
     
     # Read existing sources.yml
     try:
         with open(sources_file, 'r') as f:
             original_content = f.read()
-            lines = original_content.splitlines(keepends=True)
     except Exception as e:
         print(f"❌ Error reading sources file: {e}")
         sys.exit(1)
     
-    # Parse to check if entry already exists
-    sources_data = yaml.safe_load(original_content)
-    sources_list = sources_data.get('sources', [])
-    raw_kafka_source = None
+    new_table_names = list(dict.fromkeys(generate_source_config(t)['name'] for t in table_names))
     
-    for source in sources_list:
-        if source.get('name') == 'kafka_realtime':
-            raw_kafka_source = source
-            break
-    
-    if not raw_kafka_source:
-        print("❌ Error: 'kafka_realtime' source not found in file")
-        return False, None, None
-    
-    # Check if table already exists
-    tables = raw_kafka_source.get('tables', [])
-    existing_table_names = [t.get('name') for t in tables]
-    
-    new_table = generate_source_config(table_name)
-    new_table_name = new_table['name']
-    
-    if new_table_name in existing_table_names:
-        print(f"⚠️  Table '{new_table_name}' already exists in sources")
-        return False, None, None
+    # Parse to check if entries already exist - unless the source is clearly there
+    # and none of the table names appear in the file, so they can't be listed
+    if (any(name in original_content for name in new_table_names)
+            or not _KAFKA_SOURCE_RE.search(original_content)):
+        sources_data = _load_sources(original_content)
+        sources_list = sources_data.get('sources', [])
+        raw_kafka_source = None
+        
+        for source in sources_list:
+            if source.get('name') == 'kafka_realtime':
+                raw_kafka_source = source
+                break
+        
+        if not raw_kafka_source:
+            print("❌ Error: 'kafka_realtime' source not found in file")
+            return [], None, None
+        
+        # Check if tables already exist
+        tables = raw_kafka_source.get('tables', [])
+        existing_table_names = {t.get('name') for t in tables}
+        
+        for name in new_table_names:
+            if name in existing_table_names:
+                print(f"⚠️  Table '{name}' already exists in sources")
+        new_table_names = [name for name in new_table_names if name not in existing_table_names]
+        
+        if not new_table_names:
+            return [], None, None
     
-    print(f"➕ Adding table '{new_table_name}' to sources in alphabetical order")
+    for name in new_table_names:
+        print(f"➕ Adding table '{name}' to sources in alphabetical order")
     
-    # Find all existing table entries and their line numbers
+    # Find all existing table entries and their offsets in a single pass
     # We need to find entries under the 'tables:' section, not the source name
-    table_pattern = re.compile(r'^(\s+)-\s+name:\s+(.+)$')
     table_entries = []
-    in_tables_section = False
+    tables_match = _TABLES_KEY_RE.search(original_content)
     
-    for i, line in enumerate(lines):
-        # Detect when we enter the tables section
-        if 'tables:' in line:
-            in_tables_section = True
-            continue
+    if tables_match:
+        # Start on the line after 'tables:'
+        section_start = original_content.find('\n', tables_match.end()) + 1 or len(original_content)
         
         # Stop if we hit another top-level key (less indentation than tables)
-        if in_tables_section and line.strip() and not line.startswith(' ' * 4):
-            # If line doesn't start with at least 4 spaces, we've left the tables section
-            if not line.startswith(' '):
+        section_end = len(original_content)
+        end_match = _SECTION_END_RE.search(original_content, section_start)
+        while end_match:
+            if not _TABLES_KEY_RE.match(end_match.group(0)):
+                section_end = end_match.start()
                 break
+            end_match = _SECTION_END_RE.search(original_content, end_match.end())
         
-        if in_tables_section:
-            match = table_pattern.match(line)
-            if match:
-                indent = match.group(1)
-                tname = match.group(2).strip()
-                table_entries.append((i, indent, tname))
+        for match in _TABLE_ENTRY_RE.finditer(original_content, section_start, section_end):
+            if 'tables:' in match.group(0):
+                continue
+            table_entries.append((match.start(), match.end(), match.group(1), match.group(2).strip()))
     
     if not table_entries:
         print("❌ Error: Could not find any table entries in sources file")
-        return False, None, None
-    
-    # Find alphabetical insert position
-    insert_line = None
-    indent_to_use = table_entries[0][1]  # Use same indentation as existing entries
+        return [], None, None
     
-    for line_num, indent, tname in table_entries:
-        if new_table_name < tname:
-            # Insert before this entry
-            insert_line = line_num
-            break
-    
-    if insert_line is None:
-        # Append after last table
-        last_table_line = table_entries[-1][0]
-        insert_line = last_table_line + 1
+    indent_to_use = table_entries[0][2]  # Use same indentation as existing entries
     
-    # Create new entry with minimal formatting (name only, no description)
-    new_lines = [
-        f"{indent_to_use}- name: {new_table['name']}\n"
-    ]
+    # After the last table, unless an entry sorts after the new name
+    append_offset = original_content.find('\n', table_entries[-1][1]) + 1 or len(original_content)
     
-    # Insert the new lines
-    new_lines_copy = lines.copy()
-    new_lines_copy[insert_line:insert_line] = new_lines
-    new_content = ''.join(new_lines_copy)
+    # Find alphabetical insert positions; names sharing a position go in sorted order
+    entries_by_offset = defaultdict(list)
+    for name in sorted(new_table_names):
+        insert_offset = append_offset
+        for line_start, line_end, indent, tname in table_entries:
+            if name < tname:
+                # Insert before this entry
+                insert_offset = line_start
+                break
+        
+        # Create new entry with minimal formatting (name only, no description)
+        entries_by_offset[insert_offset].append(f"{indent_to_use}- name: {name}\n")
+    
+    # Splice the new entries into the original content
+    pieces = []
+    prev = 0
+    for insert_offset in sorted(entries_by_offset):
+        pieces.append(original_content[prev:insert_offset])
+        pieces.extend(entries_by_offset[insert_offset])
+        prev = insert_offset
+    pieces.append(original_content[prev:])
+    new_content = ''.join(pieces)
     
     if not dry_run:
         # Write back to file
         with open(sources_file, 'w') as f:
             f.write(new_content)
-        print(f"✅ Updated {sources_file} (added 1 line only)")
+        added_lines = len(new_table_names)
+        print(f"✅ Updated {sources_file} (added {added_lines} line{'s' if added_lines != 1 else ''} only)")
     
-    return True, original_content, new_content
+    if not return_contents:
+        return new_table_names, None, None
+    return new_table_names, original_content, new_content
 
 
 def create_dbt_model_file(models_dir, model_name, table_name, fields, topic='', field_types=None, flatten_array=None, dry_run=False):
@@ -695,128 +1189,57 @@ from {{{{ ref('{raw_model_name}') }}}}
     return True, str(model_path), model_sql
 
 
-def main():
-    parser = argparse.ArgumentParser(
-        description='Create dbt extraction layer for Kafka topic'
-    )
-    parser.add_argument(
-        '--topic',
-        required=True,
-        help='Kafka topic name (e.g., customer.action.v1)'
-    )
-    parser.add_argument(
-        '--sources-file',
-        required=True,
-        help='Path to sources.yml file'
-    )
-    parser.add_argument(
-        '--models-dir',
-        required=True,
-        help='Path to dbt models directory'
-    )
-    parser.add_argument(
-        '--fields',
-        default=None,
-        help='Comma-separated fields to extract (auto-discovered if not provided)'
-    )
-    parser.add_argument(
-        '--auto-discover',
-        action='store_true',
-        help='Auto-discover schema from Snowflake (requires Snowflake credentials)'
-    )
-    parser.add_argument(
-        '--snowflake-account',
-        help='Snowflake account (or set SNOWFLAKE_ACCOUNT env var)'
-    )
-    parser.add_argument(
-        '--snowflake-user',
-        help='Snowflake user (or set SNOWFLAKE_USER env var)'
-    )
-    parser.add_argument(
-        '--snowflake-password',
-        help='Snowflake password (or set SNOWFLAKE_PASSWORD env var). Not needed if using --snowflake-authenticator=externalbrowser'
-    )
-    parser.add_argument(
-        '--snowflake-authenticator',
-        help='Snowflake authenticator (e.g., "externalbrowser" for SSO, or set SNOWFLAKE_AUTHENTICATOR env var)'
-    )
-    parser.add_argument(
-        '--snowflake-warehouse',
-        help='Snowflake warehouse (or set SNOWFLAKE_WAREHOUSE env var)'
-    )
-    parser.add_argument(
-        '--snowflake-database',
-        help='Snowflake database (or set SNOWFLAKE_DATABASE env var)'
-    )
-    parser.add_argument(
-        '--snowflake-schema',
-        default='public',
-        help='Snowflake schema (or set SNOWFLAKE_SCHEMA env var)'
-    )
-    parser.add_argument(
-        '--snowflake-role',
-        help='Snowflake role (or set SNOWFLAKE_ROLE env var)'
-    )
-    parser.add_argument(
-        '--sample-size',
-        type=int,
-        default=100,
-        help='Number of records to sample for schema discovery (default: 100)'
-    )
-    parser.add_argument(
-        '--flatten-array',
-        help='Array field name to flatten with LATERAL FLATTEN (auto-detected if not specified)'
-    )
-    parser.add_argument(
-        '--dry-run',
-        action='store_true',
-        help='Show what would be changed without modifying files'
-    )
-    
-    args = parser.parse_args()
-    
+def run(topic, sources_file, models_dir, fields=None, auto_discover=False,
+        snowflake_account=None, snowflake_user=None, snowflake_password=None,
+        snowflake_authenticator=None, snowflake_warehouse=None, snowflake_database=None,
+        snowflake_schema='public', snowflake_role=None, sample_size=100,
+        flatten_array=None, dry_run=False, show_changes=True):
+    """
+    Add the source entry and extraction model for topic (same as the CLI).
+    With show_changes=False the exact file changes (sources diff, model SQL) aren't printed.
+    """
     # Validate paths exist
-    sources_file = Path(args.sources_file)
-    models_dir = Path(args.models_dir)
+    sources_path = Path(sources_file)
+    models_path = Path(models_dir)
     
-    if not sources_file.exists():
-        print(f"❌ Error: Sources file not found: {args.sources_file}")
+    if not sources_path.exists():
+        print(f"❌ Error: Sources file not found: {sources_file}")
         sys.exit(1)
     
-    if not models_dir.exists():
-        print(f"❌ Error: Models directory not found: {args.models_dir}")
+    if not models_path.exists():
+        print(f"❌ Error: Models directory not found: {models_dir}")
         sys.exit(1)
     
     # Generate names
-    table_name = generate_table_name(args.topic)
-    model_name = generate_model_name(args.topic)  # Pass topic directly, not table_name
+    table_name = generate_table_name(topic)
+    model_name = generate_model_name(topic)  # Pass topic directly, not table_name
     
     print("="*70)
     print("📋 Step 3 - dbt Extraction Layer")
     print("="*70)
-    print(f"\n✅ Topic: {args.topic}")
+    print(f"\n✅ Topic: {topic}")
     print(f"✅ Table: {table_name}")
     print(f"✅ Model: {model_name}")
     
     # Determine fields to use
-    fields_to_use = args.fields
+    fields_to_use = fields
     field_types_discovered = None
-    flatten_array = args.flatten_array
+    manual_flatten_array = flatten_array
     
-    if args.auto_discover or (args.fields is None and any([
-        args.snowflake_account,
+    if auto_discover or (fields is None and any([
+        snowflake_account,
         os.getenv('SNOWFLAKE_ACCOUNT')
     ])):
         # Build Snowflake config from args or environment variables
         snowflake_config = {
-            'account': args.snowflake_account or os.getenv('SNOWFLAKE_ACCOUNT'),
-            'user': args.snowflake_user or os.getenv('SNOWFLAKE_USER'),
-            'password': args.snowflake_password or os.getenv('SNOWFLAKE_PASSWORD'),
-            'authenticator': args.snowflake_authenticator or os.getenv('SNOWFLAKE_AUTHENTICATOR'),
-            'warehouse': args.snowflake_warehouse or os.getenv('SNOWFLAKE_WAREHOUSE'),
-            'database': args.snowflake_database or os.getenv('SNOWFLAKE_DATABASE'),
-            'schema': args.snowflake_schema or os.getenv('SNOWFLAKE_SCHEMA', 'public'),
-            'role': args.snowflake_role or os.getenv('SNOWFLAKE_ROLE'),
+            'account': snowflake_account or os.getenv('SNOWFLAKE_ACCOUNT'),
+            'user': snowflake_user or os.getenv('SNOWFLAKE_USER'),
+            'password': snowflake_password or os.getenv('SNOWFLAKE_PASSWORD'),
+            'authenticator': snowflake_authenticator or os.getenv('SNOWFLAKE_AUTHENTICATOR'),
+            'warehouse': snowflake_warehouse or os.getenv('SNOWFLAKE_WAREHOUSE'),
+            'database': snowflake_database or os.getenv('SNOWFLAKE_DATABASE'),
+            'schema': snowflake_schema or os.getenv('SNOWFLAKE_SCHEMA', 'public'),
+            'role': snowflake_role or os.getenv('SNOWFLAKE_ROLE'),
         }
         
         # Auto-default to externalbrowser if no password or authenticator provided
@@ -837,7 +1260,7 @@ def main():
             discovery_result = discover_schema_from_snowflake(
                 table_name, 
                 snowflake_config, 
-                args.sample_size
+                sample_size
             )
             
             if discovery_result and isinstance(discovery_result, tuple):
@@ -863,13 +1286,12 @@ def main():
     
     # If still None, use defaults
     if fields_to_use is None:
-        fields_to_use = 'id,timestamp,user_id,event_type'
-        print(f"✅ Using default fields: {fields_to_use}")
+        fields_to_use = _canonical_fields('id,timestamp,user_id,event_type')
+        print(f"✅ Using default fields: {','.join(fields_to_use)}")
     else:
-        if isinstance(fields_to_use, list):
-            print(f"✅ Using fields: {', '.join(fields_to_use[:5])}{'...' if len(fields_to_use) > 5 else ''} ({len(fields_to_use)} total)")
-        else:
-            print(f"✅ Using fields: {fields_to_use}")
+        # Normalize once; everything below works on the tuple of names
+        fields_to_use = _canonical_fields(fields_to_use)
+        print(f"✅ Using fields: {', '.join(fields_to_use[:5])}{'...' if len(fields_to_use) > 5 else ''} ({len(fields_to_use)} total)")
     
     # Determine unique key (priority: field-based > topic-based)
     detected_unique_key = None
@@ -878,15 +1300,14 @@ def main():
     
     if fields_to_use:
         # Try to detect from actual fields in the data
-        field_list = fields_to_use if isinstance(fields_to_use, list) else [f.strip() for f in fields_to_use.split(',')]
-        inferred_from_fields = infer_unique_key_from_fields(field_list)
+        inferred_from_fields = infer_unique_key_from_fields(fields_to_use)
         if inferred_from_fields:
             detected_unique_key, detected_base_field, _ = inferred_from_fields
             unique_key_source = "detected from data fields (surrogate with ce_id)"
     
     if not detected_unique_key:
         # Fallback to topic-based inference
-        detected_unique_key, _ = infer_unique_key_from_topic(args.topic)
+        detected_unique_key, _ = infer_unique_key_from_topic(topic)
         unique_key_source = "inferred from topic pattern"
     
     print(f"✅ Unique_key: {detected_unique_key} ({unique_key_source})")
@@ -895,27 +1316,29 @@ def main():
     
     # Display array flattening info (may have been set during discovery)
     if flatten_array:
-        if args.flatten_array:
+        if manual_flatten_array:
             print(f"✅ Array flattening: {flatten_array} (manually specified)")
         else:
             print(f"✅ Array flattening: {flatten_array} (auto-detected from schema)")
     
-    if args.dry_run:
+    if dry_run:
         print(f"\n🔍 DRY RUN MODE - No files will be modified")
     
     # Add source to sources.yml
-    source_added, sources_original, sources_new = add_source_to_yaml(sources_file, table_name, args.dry_run)
+    source_added, sources_original, sources_new = add_source_to_yaml(
+        sources_path, table_name, dry_run, return_contents=show_changes
+    )
     
     # Create dbt model file (detects override_id automatically inside the function)
     model_created, model_path, model_content = create_dbt_model_file(
-        models_dir, 
+        models_path, 
         model_name, 
         table_name, 
         fields_to_use, 
-        args.topic, 
+        topic, 
         field_types_discovered,
         flatten_array,
-        args.dry_run
+        dry_run
     )
     
     # No typecast model for realtime sink - only one model is created
@@ -924,51 +1347,49 @@ def main():
     typecast_content = None
     
     # Show exact file changes (what WOULD be created in dry-run, or what WAS created)
-    if source_added or model_created:
+    anything_changed = source_added or model_created
+    
+    if show_changes and anything_changed:
         print("\n" + "="*70)
-        if args.dry_run:
+        if dry_run:
             print("📝 EXACT FILE CHANGES (DRY RUN - These files would be created/modified)")
         else:
             print("📝 EXACT FILE CHANGES")
         print("="*70)
         
-        # Show sources.yml diff
-        if source_added and sources_original and sources_new:
-            if args.dry_run:
-                print(f"\n1. {sources_file} (WOULD MODIFY)")
+        # Show sources.yml diff (both contents are None when nothing was added)
+        if source_added and sources_new != sources_original:
+            if dry_run:
+                print(f"\n1. {sources_path} (WOULD MODIFY)")
             else:
-                print(f"\n1. {sources_file}")
+                print(f"\n1. {sources_path}")
             print("-" * 70)
             
-            original_lines = sources_original.splitlines(keepends=True)
-            new_lines = sources_new.splitlines(keepends=True)
-            
-            diff = unified_diff(
-                original_lines,
-                new_lines,
-                fromfile=f'{sources_file} (original)',
-                tofile=f'{sources_file} (modified)',
-                lineterm=''
-            )
-            
-            diff_lines = list(diff)
-            if diff_lines:
-                for line in diff_lines:
-                    # Color code the diff output
-                    if line.startswith('+++') or line.startswith('---'):
-                        print(f"\033[1m{line}\033[0m")  # Bold
-                    elif line.startswith('+'):
-                        print(f"\033[32m{line}\033[0m")  # Green
-                    elif line.startswith('-'):
-                        print(f"\033[31m{line}\033[0m")  # Red
-                    elif line.startswith('@@'):
-                        print(f"\033[36m{line}\033[0m")  # Cyan
-                    else:
-                        print(line)
+            if len(sources_new) > DIFF_MAX_CHARS:
+                added_lines = sources_new.count('\n') - sources_original.count('\n')
+                print(f"+ {added_lines} line{'s' if added_lines != 1 else ''} at {sources_path} "
+                      f"(diff skipped, file over {DIFF_MAX_CHARS // 1024} KB)")
+            else:
+                # Imported here: only runs that add a source diff anything
+                from difflib import unified_diff
+                
+                diff = unified_diff(
+                    sources_original.splitlines(),
+                    sources_new.splitlines(),
+                    fromfile=f'{sources_path} (original)',
+                    tofile=f'{sources_path} (modified)',
+                    lineterm=''
+                )
+                
+                # Write the diff in one call as it is produced; color code it only for a terminal
+                if sys.stdout.isatty():
+                    sys.stdout.writelines(map(_color_diff_line, diff))
+                else:
+                    sys.stdout.writelines(f"{line}\n" for line in diff)
         
         # Show new model file
         if model_created and model_path and model_content:
-            if args.dry_run:
+            if dry_run:
                 print(f"\n2. {model_path} (WOULD CREATE)")
             else:
                 print(f"\n2. {model_path} (NEW FILE)")
@@ -980,29 +1401,104 @@ def main():
     
     # Summary
     print("\n" + "="*70)
+    print("🔍 DRY RUN COMPLETE - No changes written" if dry_run else "✅ COMPLETE")
+    print("="*70)
     
-    if args.dry_run:
-        print("🔍 DRY RUN COMPLETE - No changes written")
-        print("="*70)
-        if source_added or model_created:
-            print("\n✅ Would create:")
-            if source_added:
-                print(f"   - Source entry in {sources_file}")
-            if model_created:
-                print(f"   - Model file: models/staging/kafka_realtime/{model_name}.sql")
-        else:
-            print("\nℹ️  No changes needed (files already exist)")
-    else:
-        print("✅ COMPLETE")
-        print("="*70)
-        if source_added or model_created:
-            print("\n✅ Created:")
-            if source_added:
-                print(f"   - Source entry in {sources_file}")
-            if model_created:
-                print(f"   - Model file: models/staging/kafka_realtime/{model_name}.sql")
-        else:
-            print("\nℹ️  No changes needed (files already exist)")
+    if not anything_changed:
+        print("\nℹ️  No changes needed (files already exist)")
+        return
+    
+    print("\n✅ Would create:" if dry_run else "\n✅ Created:")
+    if source_added:
+        print(f"   - Source entry in {sources_path}")
+    if model_created:
+        print(f"   - Model file: models/staging/kafka_realtime/{model_name}.sql")
+
+
+def main():
+    # Only the CLI needs argparse
+    import argparse
+    
+    parser = argparse.ArgumentParser(
+        description='Create dbt extraction layer for Kafka topic'
+    )
+    parser.add_argument(
+        '--topic',
+        required=True,
+        help='Kafka topic name (e.g., customer.action.v1)'
+    )
+    parser.add_argument(
+        '--sources-file',
+        required=True,
+        help='Path to sources.yml file'
+    )
+    parser.add_argument(
+        '--models-dir',
+        required=True,
+        help='Path to dbt models directory'
+    )
+    parser.add_argument(
+        '--fields',
+        default=None,
+        help='Comma-separated fields to extract (auto-discovered if not provided)'
+    )
+    parser.add_argument(
+        '--auto-discover',
+        action='store_true',
+        help='Auto-discover schema from Snowflake (requires Snowflake credentials)'
+    )
+    parser.add_argument(
+        '--snowflake-account',
+        help='Snowflake account (or set SNOWFLAKE_ACCOUNT env var)'
+    )
+    parser.add_argument(
+        '--snowflake-user',
+        help='Snowflake user (or set SNOWFLAKE_USER env var)'
+    )
+    parser.add_argument(
+        '--snowflake-password',
+        help='Snowflake password (or set SNOWFLAKE_PASSWORD env var). Not needed if using --snowflake-authenticator=externalbrowser'
+    )
+    parser.add_argument(
+        '--snowflake-authenticator',
+        help='Snowflake authenticator (e.g., "externalbrowser" for SSO, or set SNOWFLAKE_AUTHENTICATOR env var)'
+    )
+    parser.add_argument(
+        '--snowflake-warehouse',
+        help='Snowflake warehouse (or set SNOWFLAKE_WAREHOUSE env var)'
+    )
+    parser.add_argument(
+        '--snowflake-database',
+        help='Snowflake database (or set SNOWFLAKE_DATABASE env var)'
+    )
+    parser.add_argument(
+        '--snowflake-schema',
+        default='public',
+        help='Snowflake schema (or set SNOWFLAKE_SCHEMA env var)'
+    )
+    parser.add_argument(
+        '--snowflake-role',
+        help='Snowflake role (or set SNOWFLAKE_ROLE env var)'
+    )
+    parser.add_argument(
+        '--sample-size',
+        type=int,
+        default=100,
+        help='Number of records to sample for schema discovery (default: 100)'
+    )
+    parser.add_argument(
+        '--flatten-array',
+        help='Array field name to flatten with LATERAL FLATTEN (auto-detected if not specified)'
+    )
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='Show what would be changed without modifying files'
+    )
+    
+    args = parser.parse_args()
+    
+    run(**vars(args))
 
 
 if __name__ == '__main__':
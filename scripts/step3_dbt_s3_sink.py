@@ -7,22 +7,167 @@ that lands in S3.
 """
 
 import argparse
+import bisect
+import os
+import re
+import shutil
 import subprocess
+import sys
+import tempfile
+import yaml
+from functools import lru_cache
 from pathlib import Path
 
+# Resolved once; None when sqlfluff isn't on PATH
+_SQLFLUFF_BIN = shutil.which('sqlfluff')
+
+# `- name: <table>` entry lines (and the nested `- name:` lines of partitions)
+_TABLE_ENTRY_RE = re.compile(r'^\s*-\s+name:\s+(.+)$')
+
+# YAML header for a new sources file
+_SOURCES_HEADER = """version: 2
+
+sources:
+  - name: kafka_s3
+    database: raw_kafka_s3_production
+    schema: public
+    tables:
+"""
+
+# Source definition for one topic's table, filled in with str.format
+_SOURCE_DEFINITION_TEMPLATE = """      - name: {topic_table}
+        description: This is an external table, mounted on an S3 bucket correlating to Kafka topic {topic}
+        external:
+          location: "@raw_kafka_s3_production.public.stage_kafka_s3_production/{topic}/"
+          file_format: "( type = json )"
+          partitions:
+            - name: dt
+              data_type: date
+              expression: >-
+                to_date(split_part(split_part(metadata$filename, '/', 3), '=', 2)
+                        || '-' ||
+                        split_part(split_part(metadata$filename, '/', 4), '=', 2)
+                        || '-' ||
+                        split_part(split_part(metadata$filename, '/', 5), '=', 2))
+"""
+# The same template as newline-terminated lines, to splice into the sources lines
+_SOURCE_DEFINITION_LINES = _SOURCE_DEFINITION_TEMPLATE.splitlines(keepends=True)
+
+_BASE_MODEL_TEMPLATE = (
+    "{{{{\n"
+    "    config(\n"
+    "        pre_hook='{{{{ stage_external_source_prehook(external_table=\"kafka_s3.{topic_table}\") }}}}',\n"
+    "    )\n"
+    "}}}}\n"
+    "\n"
+    "{{{{ kafka_base('s3', '{topic_table}') }}}}\n"
+    "{{{{ dev_limit() }}}}\n"
+)
+
+_TYPECAST_MODEL_TEMPLATE = (
+    "{{{{ config(alias='{alias}') }}}}\n"
+    "\n"
+    "with raw as (select * from {{{{ ref('{base_model}') }}}})\n"
+    "\n"
+    "select *\n"
+    "\n"
+    "from raw\n"
+)
+
+
+def existing_table_names(sources_content):
+    """Names of the tables already listed under the kafka_s3 source."""
+    try:
+        sources_data = yaml.safe_load(sources_content) or {}
+    except yaml.YAMLError as e:
+        print(f"❌ Error parsing sources file: {e}")
+        sys.exit(1)
+    
+    table_names = set()
+    for source in sources_data.get('sources') or []:
+        if source.get('name') == 'kafka_s3':
+            table_names.update(table.get('name') for table in source.get('tables') or [])
+    return table_names
+
+
+@lru_cache(maxsize=None)
+def _ensure_dir(path):
+    """Create the directory at path (an absolute Path) unless it exists, once per process."""
+    if not path.is_dir():
+        path.mkdir(parents=True, exist_ok=True)
+
+
+def write_text_atomic(path, content):
+    """Write content to path through a sibling temp file, so it is never left half-written."""
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(content)
+        # Keep the existing file's mode; mkstemp's 0600 is too narrow for a new one
+        if path.exists():
+            shutil.copymode(path, tmp_path)
+        else:
+            os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def find_table_entries(lines):
+    """
+    Locate the table entries under 'tables:' in one pass over the sources file lines.
+    
+    Returns:
+        List of (table_name, start_line, end_line) in file order, where end_line is
+        one past the entry's last line
+    """
+    table_entries = []
+    tables_indent = None
+    table_indent = None
+    # The entry being scanned, recorded once the next one starts
+    current_name = current_start = current_end = None
+    
+    for i, line in enumerate(lines):
+        stripped = line.lstrip()
+        indent = len(line) - len(stripped)
+        
+        # Detect when we enter the tables section (the key itself, not a comment
+        # or value that mentions it)
+        if tables_indent is None:
+            if stripped.startswith('tables:'):
+                tables_indent = indent
+            continue
+        
+        # Blank lines and comments neither end nor extend an entry
+        if not stripped or stripped[0] == '#':
+            continue
+        
+        # Stop if we hit another key at or above the level of 'tables:'
+        if indent <= tables_indent:
+            break
+        
+        match = _TABLE_ENTRY_RE.match(line)
+        if match and (table_indent is None or indent == table_indent):
+            # A new table; deeper `- name:` lines (partitions) belong to the current one
+            if current_name is not None:
+                table_entries.append((current_name, current_start, current_end))
+            table_indent = indent
+            current_name, current_start, current_end = match.group(1).strip(), i, i + 1
+        elif table_indent is not None and indent > table_indent:
+            current_end = i + 1
+        elif table_indent is not None:
+            break
+    
+    if current_name is not None:
+        table_entries.append((current_name, current_start, current_end))
+    
+    return table_entries
+
 
 def generate_base_model_sql(topic_table):
     """Generate the base external model SQL."""
-    return (
-        "{{\n"
-        "    config(\n"
-        f"        pre_hook='{{{{ stage_external_source_prehook(external_table=\"kafka_s3.{topic_table}\") }}}}',\n"
-        "    )\n"
-        "}}\n"
-        "\n"
-        f"{{{{ kafka_base('s3', '{topic_table}') }}}}\n"
-        "{{ dev_limit() }}\n"
-    )
+    return _BASE_MODEL_TEMPLATE.format(topic_table=topic_table)
 
 
 def generate_typecast_model_sql(topic_table, base_model):
@@ -30,43 +175,35 @@ def generate_typecast_model_sql(topic_table, base_model):
     # Generate clean alias without stg_kafka__ prefix
     alias = topic_table
     
-    return (
-        f"{{{{ config(alias='{alias}') }}}}\n"
-        "\n"
-        f"with raw as (select * from {{{{ ref('{base_model}') }}}})\n"
-        "\n"
-        "select *\n"
-        "\n"
-        "from raw\n"
-    )
+    return _TYPECAST_MODEL_TEMPLATE.format(alias=alias, base_model=base_model)
 
 
-def run_sqlfluff(filepath):
-    """Run sqlfluff fix on a SQL file."""
+def run_sqlfluff(filepaths):
+    """
+    Run sqlfluff fix on SQL files, in a single sqlfluff invocation that
+    fixes the files in parallel worker processes.
+    """
+    if _SQLFLUFF_BIN is None:
+        print(f"   ⚠️  sqlfluff not installed - skipping formatting")
+        return False
+    
+    names = ', '.join(filepath.name for filepath in filepaths)
+    processes = str(max(1, min(len(filepaths), os.cpu_count() or 1)))
+    
     try:
-        # Check if sqlfluff is available
-        check_result = subprocess.run(
-            ['sqlfluff', '--version'],
-            capture_output=True,
-            text=True
-        )
-        
-        if check_result.returncode != 0:
-            print(f"   ⚠️  sqlfluff not found - skipping formatting")
-            return False
-        
         # Run sqlfluff fix
         result = subprocess.run(
-            ['sqlfluff', 'fix', '--dialect', 'snowflake', str(filepath)],
+            [_SQLFLUFF_BIN, 'fix', '--dialect', 'snowflake', '--processes', processes,
+             *map(str, filepaths)],
             capture_output=True,
             text=True
         )
         
         if result.returncode == 0:
-            print(f"   ✅ Formatted with sqlfluff: {filepath.name}")
+            print(f"   ✅ Formatted with sqlfluff: {names}")
             return True
         else:
-            print(f"   ⚠️  sqlfluff had issues (non-critical): {filepath.name}")
+            print(f"   ⚠️  sqlfluff had issues (non-critical): {names}")
             if result.stderr:
                 print(f"      {result.stderr.strip()}")
             return False
@@ -79,34 +216,13 @@ def run_sqlfluff(filepath):
         return False
 
 
-def main():
-    # Parse command-line arguments
-    parser = argparse.ArgumentParser(
-        description='Bootstrap Kafka external sources in dbt for a single topic'
-    )
-    parser.add_argument(
-        '--topic',
-        required=True,
-        help='Kafka topic name (e.g., customer.action.v1)'
-    )
-    parser.add_argument(
-        '--value-type',
-        required=True,
-        choices=['json', 'protobuf'],
-        help='Value type for the topic'
-    )
-    parser.add_argument(
-        '--dry-run',
-        action='store_true',
-        help='Show what would be changed without modifying files'
-    )
-    args = parser.parse_args()
-
-    print(f"🎯 Processing S3 external source for: {args.topic} ({args.value_type})")
+def run(topic, value_type, dry_run=False):
+    """Add the external source and staging models for topic under cwd (same as the CLI)."""
+    print(f"🎯 Processing S3 external source for: {topic} ({value_type})")
 
     # Convert topic name to table name
     # Example: threat.virustotal_raw.v1 -> threat__virustotal_raw__v1
-    topic_table = args.topic.replace(".", "__").replace("-", "_")
+    topic_table = topic.replace(".", "__").replace("-", "_")
     
     print(f"📊 Table name: {topic_table}")
 
@@ -115,53 +231,31 @@ def main():
     external_path = output_path / "external"
     sources_file = external_path / "_kafka_external__sources.yml"
 
-    # Ensure directories exist
-    external_path.mkdir(parents=True, exist_ok=True)
+    # Ensure directories exist (absolute, as run() may be called from several repos)
+    _ensure_dir(external_path.absolute())
 
     # Read existing sources file or create new one
-    if sources_file.exists():
+    try:
+        existing_content = sources_file.read_text(encoding='utf-8')
+    except FileNotFoundError:
+        print(f"\n📄 Creating new sources file: {sources_file}")
+        existing_content = None
+    else:
         print(f"\n📄 Reading existing sources file: {sources_file}")
-        with open(sources_file, 'r') as f:
-            existing_content = f.read()
         
-        # Check if topic already exists
-        if topic_table in existing_content:
-            print(f"⚠️  Topic '{args.topic}' (table: {topic_table}) already exists in sources file")
+        # Check if topic already exists - only parse when the name appears as a
+        # whole word, since otherwise it can't be listed (foo__v1 vs foo__v10)
+        if (re.search(rf'\b{re.escape(topic_table)}\b', existing_content)
+                and topic_table in existing_table_names(existing_content)):
+            print(f"⚠️  Topic '{topic}' (table: {topic_table}) already exists in sources file")
             print("   No changes needed")
             return
-    else:
-        print(f"\n📄 Creating new sources file: {sources_file}")
-        existing_content = None
-
-    # YAML header for sources file
-    header = """version: 2
 
-sources:
-  - name: kafka_s3
-    database: raw_kafka_s3_production
-    schema: public
-    tables:
-"""
-
-    # Source definition template
-    source_definition = f"""      - name: {topic_table}
-        description: This is an external table, mounted on an S3 bucket correlating to Kafka topic {args.topic}
-        external:
-          location: "@raw_kafka_s3_production.public.stage_kafka_s3_production/{args.topic}/"
-          file_format: "( type = json )"
-          partitions:
-            - name: dt
-              data_type: date
-              expression: >-
-                to_date(split_part(split_part(metadata$filename, '/', 3), '=', 2)
-                        || '-' ||
-                        split_part(split_part(metadata$filename, '/', 4), '=', 2)
-                        || '-' ||
-                        split_part(split_part(metadata$filename, '/', 5), '=', 2))
-"""
+    # Source definition for this topic
+    source_lines = [line.format(topic_table=topic_table, topic=topic) for line in _SOURCE_DEFINITION_LINES]
 
     # Write the updated sources file
-    if args.dry_run:
+    if dry_run:
         print("\n🔍 DRY RUN MODE - No files will be modified")
         print(f"\n📝 Would update sources file: {sources_file}")
         print(f"   Would add table: {topic_table}")
@@ -180,76 +274,40 @@ sources:
     
     if existing_content:
         # Insert alphabetically without moving existing entries
-        import re
-        
         lines = existing_content.splitlines(keepends=True)
-        
-        # Find all existing table entries and their line numbers
-        table_pattern = re.compile(r'^(\s+)-\s+name:\s+(.+)$')
-        table_entries = []
-        in_tables_section = False
-        
-        for i, line in enumerate(lines):
-            # Detect when we enter the tables section
-            if 'tables:' in line:
-                in_tables_section = True
-                continue
-            
-            # Stop if we hit another top-level key (less indentation than tables)
-            if in_tables_section and line.strip() and not line.startswith(' ' * 4):
-                # If line doesn't start with at least 4 spaces, we've left the tables section
-                if not line.startswith(' '):
-                    break
-            
-            if in_tables_section:
-                match = table_pattern.match(line)
-                if match:
-                    indent = match.group(1)
-                    tname = match.group(2).strip()
-                    table_entries.append((i, indent, tname))
+        table_entries = find_table_entries(lines)
         
         if not table_entries:
             # No tables found, append at the end
-            with open(sources_file, 'a') as outfile:
-                outfile.write(source_definition)
+            write_text_atomic(sources_file, existing_content + ''.join(source_lines))
             print(f"   ✅ Added external source definition for {topic_table}")
         else:
-            # Find alphabetical insert position
-            insert_line = None
-            indent_to_use = table_entries[0][1]  # Use same indentation as existing entries
-            
-            for line_num, indent, tname in table_entries:
-                if topic_table < tname:
-                    # Insert before this entry
-                    insert_line = line_num
-                    break
-            
-            if insert_line is None:
-                # Append after last table
-                last_table_line = table_entries[-1][0]
-                # Find the end of the last table entry (look for next table or end of section)
-                insert_line = last_table_line + 1
-                # Skip any lines that are part of the last table entry
-                while insert_line < len(lines) and lines[insert_line].startswith(' ' * 8):
-                    insert_line += 1
+            # Find alphabetical insert position: before the first table that sorts
+            # after the new one, or after the last table's entry. The tables aren't
+            # guaranteed to be sorted, so only bisect when they are
+            table_names = [name for name, _, _ in table_entries]
+            if all(a <= b for a, b in zip(table_names, table_names[1:])):
+                insert_index = bisect.bisect_right(table_names, topic_table)
+            else:
+                insert_index = next(
+                    (i for i, name in enumerate(table_names) if topic_table < name), len(table_names)
+                )
+            if insert_index < len(table_entries):
+                insert_line = table_entries[insert_index][1]
+            else:
+                insert_line = table_entries[-1][2]
+                if not lines[insert_line - 1].endswith('\n'):
+                    lines[insert_line - 1] += '\n'
             
             # Insert the new lines at the correct position
-            new_lines = lines.copy()
-            # Split source_definition into lines while preserving line endings
-            source_lines = [line + '\n' if not line.endswith('\n') else line 
-                           for line in source_definition.rstrip().split('\n')]
-            
-            new_lines[insert_line:insert_line] = source_lines
+            lines[insert_line:insert_line] = source_lines
             
             # Write back to file
-            with open(sources_file, 'w') as f:
-                f.write(''.join(new_lines))
+            write_text_atomic(sources_file, ''.join(lines))
             print(f"   ✅ Added external source definition for {topic_table} (alphabetically)")
     else:
         # Create new file with header
-        with open(sources_file, 'w') as outfile:
-            outfile.write(header)
-            outfile.write(source_definition)
+        write_text_atomic(sources_file, _SOURCES_HEADER + ''.join(source_lines))
         print(f"   ✅ Created sources file with definition for {topic_table}")
 
     # Generate dbt model files
@@ -266,8 +324,7 @@ sources:
 
     # Create base external view (always overwrite - it's generated)
     base_sql = generate_base_model_sql(topic_table)
-    with open(base_model_filepath, "w") as outfile:
-        outfile.write(base_sql)
+    base_model_filepath.write_text(base_sql, encoding='utf-8')
     print(f"   ✅ Created {base_view_filename}")
 
     # Create typecast view (only if it doesn't exist - may have customizations)
@@ -276,31 +333,57 @@ sources:
         print(f"   ⏭️  Skipped {typecast_view_filename} (already exists, preserving customizations)")
     else:
         typecast_sql = generate_typecast_model_sql(topic_table, base_model)
-        with open(typecast_model_filepath, "w") as outfile:
-            outfile.write(typecast_sql)
+        typecast_model_filepath.write_text(typecast_sql, encoding='utf-8')
         print(f"   ✅ Created {typecast_view_filename}")
         typecast_created = True
 
     # Run sqlfluff on generated models
     print(f"\n🔧 Running sqlfluff...")
-    run_sqlfluff(base_model_filepath)
+    sql_files = [base_model_filepath]
     if typecast_created:
-        run_sqlfluff(typecast_model_filepath)
+        sql_files.append(typecast_model_filepath)
+    run_sqlfluff(sql_files)
 
     # Summary
     print(f"\n{'='*70}")
     print(f"✅ Bootstrap complete!")
     print(f"{'='*70}")
-    print(f"Topic:       {args.topic}")
-    print(f"Value Type:  {args.value_type}")
+    print(f"Topic:       {topic}")
+    print(f"Value Type:  {value_type}")
     print(f"Table:       {topic_table}")
     print(f"\nFiles modified:")
     print(f"   - {sources_file}")
     print(f"   - {base_model_filepath}")
-    if not typecast_model_filepath.exists():
+    if typecast_created:
         print(f"   - {typecast_model_filepath} (new)")
     print(f"{'='*70}\n")
 
 
+def main():
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(
+        description='Bootstrap Kafka external sources in dbt for a single topic'
+    )
+    parser.add_argument(
+        '--topic',
+        required=True,
+        help='Kafka topic name (e.g., customer.action.v1)'
+    )
+    parser.add_argument(
+        '--value-type',
+        required=True,
+        choices=['json', 'protobuf'],
+        help='Value type for the topic'
+    )
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='Show what would be changed without modifying files'
+    )
+    args = parser.parse_args()
+
+    run(args.topic, args.value_type, args.dry_run)
+
+
 if __name__ == '__main__':
     main()
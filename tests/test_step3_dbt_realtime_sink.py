@@ -0,0 +1,62 @@
+import os
+import re
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+
+import step3_dbt_realtime_sink as sink
+
+
+class FakeCursor:
+    """Records the executed query and returns canned rows."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def execute(self, query):
+        self.queries.append(query)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+class SampleFieldStatsInSnowflakeTest(unittest.TestCase):
+    def test_query_does_not_use_reserved_sample_identifier(self):
+        cursor = FakeCursor([])
+        sink._sample_field_stats_in_snowflake(cursor, 'raw.kafka.orders', 100)
+
+        query = cursor.queries[0]
+        self.assertIn('FROM raw.kafka.orders', query)
+        self.assertIn('LIMIT 100', query)
+        # SAMPLE is a reserved keyword in Snowflake and can't name the CTE
+        self.assertIsNone(re.search(r'\bsample\b', query, re.IGNORECASE))
+
+    def test_rows_are_aggregated_into_field_stats(self):
+        cursor = FakeCursor([
+            (None, 'id', 'INTEGER', 3, 0),
+            (None, 'id', 'VARCHAR', 1, 0),
+            (None, 'items', 'ARRAY', 4, 2),
+            ('items', 'sku', 'VARCHAR', 2, 0),
+            (None, None, None, 4, 0),
+        ])
+
+        (field_counts, field_types, nested_field_counts, nested_field_types,
+         array_fields, total_records) = sink._sample_field_stats_in_snowflake(
+            cursor, 'raw.kafka.orders', 100
+        )
+
+        self.assertEqual(total_records, 4)
+        self.assertEqual(field_counts, {'id': 4, 'items': 4})
+        self.assertEqual(sink._bits_to_names(field_types['id']), {'int', 'str'})
+        self.assertEqual(sink._bits_to_names(field_types['items']), {'list'})
+        self.assertEqual(nested_field_counts, {('items', 'sku'): 2})
+        self.assertEqual(sink._bits_to_names(nested_field_types['items', 'sku']), {'str'})
+        self.assertEqual(array_fields, {'items'})
+        # The total-count row carries no type to register
+        self.assertNotIn('none', sink._TYPE_BITS)
+
+
+if __name__ == '__main__':
+    unittest.main()